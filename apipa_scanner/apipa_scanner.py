@@ -7,10 +7,24 @@
 
 import argparse
 import ipaddress
+import json
+import os
+import random
+import threading
 import time
 import sys
 import signal
-from scapy.all import ARP, Ether, srp, conf, IFACES
+from scapy.all import ARP, Ether, AsyncSniffer, conf, get_if_addr, get_if_hwaddr, IFACES
+
+# ARP requests per second sent by a sweep
+DEFAULT_RATE = 1000
+# Seconds to wait for replies after the last request of a sweep
+REPLY_WAIT = 2
+# Offset of the target IP address in an Ethernet ARP request
+ARP_TARGET_OFFSET = 38
+# Devices found by earlier scans, requested first by the next scan
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "apipa_scanner.json")
+CACHE_SIZE = 1000
 
 def signal_handler(sig, frame):
     print("\nCtrl+C detected! Aborting!")
@@ -23,36 +37,220 @@ def check_interface(interface):
         return False
     return True
 
-# 169.254.0.0/16
-def scan_apipa_range(interface, ip_range="169.254.4.0/24", timeout=60):
-    """Scan the APIPA range for active devices."""
+class ArpSweep:
+    """Sweep an IP range with ARP requests, sent at a fixed rate by a sender thread while a sniffer thread
+    collects the replies. Every address is requested once per sweep, addresses that answered are skipped
+    in the following sweeps.
 
-    # Verify the interface exists before proceeding
-    if not check_interface(interface):
-        return []
+    The sniffer also picks up the ARP probes, gratuitous ARPs and requests devices send by themselves, so with
+    listen the range is first only listened to, and the sweep can be limited to the /24 subnets not heard from."""
+
+    def __init__(self, interface, ip_range, rate=DEFAULT_RATE, sweeps=1, timeout=None, on_device=None,
+                 priority=None, hot_subnets=None):
+        self.interface = interface
+        self.network = ipaddress.ip_network(ip_range, strict=False)
+        # Sweep order: the priority addresses (e.g. seen before), the hot subnets and then the rest in random order
+        self.priority = [ipaddress.ip_address(ip) for ip in priority or []]
+        self.hot_subnets = [ipaddress.ip_network(subnet, strict=False) for subnet in hot_subnets or []]
+        self.rate = rate
+        self.sweeps = sweeps
+        self.timeout = timeout
+        # Called with the device dict when a new device is seen
+        self.on_device = on_device
+        self.hwaddr = get_if_hwaddr(interface)
+
+        # Subnets sent to by the sweep
+        self.targets = [self.network]
+        self.devices = {}
+        self.sent = 0
+        self.received = 0
+        self.duration = 0.0
+        self.start_time = time.monotonic()
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def request_template(self):
+        """Raw broadcast ARP request, the target address is filled in per request."""
+        return bytes(Ether(dst="ff:ff:ff:ff:ff:ff", src=self.hwaddr) /
+                     ARP(op=1, hwsrc=self.hwaddr, psrc=get_if_addr(self.interface), pdst="0.0.0.0"))
+
+    def bpf_filter(self):
+        """Kernel filter for the ARP packets of other hosts with a sender address in the range, or probes
+        (sender 0.0.0.0) for an address in the range."""
+        net = f"0x{int(self.network.network_address):08x}"
+        mask = f"0x{int(self.network.netmask):08x}"
+        return (f"arp and not ether src {self.hwaddr} and "
+                f"(arp[14:4] & {mask} = {net} or (arp[14:4] = 0 and arp[24:4] & {mask} = {net}))")
+
+    def handle_packet(self, packet):
+        """Sniffer callback, records the devices in the range from replies, announcements, probes and requests."""
+        if ARP not in packet or packet[ARP].hwsrc == self.hwaddr:
+            return
+        arp = packet[ARP]
+        if arp.psrc == "0.0.0.0":
+            # Probe of a device checking that the address it picked is free
+            ip, seen_by = arp.pdst, "ARP probe"
+        elif arp.op == 2:
+            ip, seen_by = arp.psrc, "ARP reply"
+        elif arp.psrc == arp.pdst:
+            ip, seen_by = arp.psrc, "gratuitous ARP"
+        else:
+            ip, seen_by = arp.psrc, "ARP request"
+        if ipaddress.ip_address(ip) not in self.network:
+            return
+
+        with self.lock:
+            self.received += 1
+            if ip in self.devices:
+                return
+            device = {'ip': ip, 'mac': arp.hwsrc, 'seen_by': seen_by,
+                      'found_after': time.monotonic() - self.start_time}
+            self.devices[ip] = device
+        if self.on_device:
+            self.on_device(device)
+
+    def unanswered_subnets(self):
+        """The /24 subnets of the range (or the range itself when smaller) without a known device."""
+        if self.network.prefixlen >= 24:
+            subnets = [self.network]
+        else:
+            subnets = self.network.subnets(new_prefix=24)
+        seen = {ipaddress.ip_network(f"{ip}/24", strict=False) for ip in self.devices}
+        return [subnet for subnet in subnets if subnet.supernet(new_prefix=24) not in seen]
+
+    def target_addresses(self):
+        """Addresses of the target subnets (without the network and broadcast address of the range) in sweep
+        order: the priority addresses, the hot subnets, and then the remaining addresses shuffled."""
+        excluded = {self.network.network_address, self.network.broadcast_address}
+        if self.targets == [self.network]:
+            in_targets = lambda ip: ip in self.network
+        else:
+            subnets = set(self.targets)
+            in_targets = lambda ip: ipaddress.ip_network(f"{ip}/{self.targets[0].prefixlen}", strict=False) in subnets
 
-    # Create an ARP request packet
-    arp_request = ARP(pdst=ip_range)
-    ether_frame = Ether(dst="ff:ff:ff:ff:ff:ff")
+        first = list(self.priority)
+        for subnet in self.hot_subnets:
+            first.extend(subnet if subnet.prefixlen < 31 else subnet.hosts())
+        for ip in first:
+            if ip not in excluded and in_targets(ip):
+                excluded.add(ip)
+                yield ip
 
-    packet = ether_frame / arp_request
+        # As integers, a shuffled /16 is a list of 65k ints
+        rest = [int(ip) for subnet in self.targets for ip in subnet]
+        random.shuffle(rest)
+        for value in rest:
+            ip = ipaddress.ip_address(value)
+            if ip not in excluded:
+                yield ip
 
-    # Set the timeout for the scan
-    start_time = time.time()
-    devices = []
+    def send_requests(self, deadline):
+        """Sender thread, sends the sweeps at the configured rate until done, stopped or the deadline."""
+        template = self.request_template()
+        l2_socket = conf.L2socket(iface=self.interface)
+        try:
+            for sweep in range(self.sweeps):
+                start = time.monotonic()
+                sent = 0
+                for ip in self.target_addresses():
+                    if self.stop_event.is_set() or (deadline and time.monotonic() >= deadline):
+                        return
+                    if str(ip) in self.devices:
+                        continue
 
-    while time.time() - start_time < timeout:
-        # Send the packet and capture responses with a 2-second timeout per cycle
-        answered_list = srp(packet, iface=interface, timeout=2, verbose=False)[0]
+                    # Ahead of the rate, wait for the send time of this request
+                    delay = start + sent / self.rate - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    l2_socket.send(template[:ARP_TARGET_OFFSET] + ip.packed + template[ARP_TARGET_OFFSET + 4:])
+                    sent += 1
+                    self.sent += 1
 
-        for sent, received in answered_list:
-            device_info = {'ip': received.psrc, 'mac': received.hwsrc}
-            if device_info not in devices:  # Avoid duplicates
-                devices.append(device_info)
+                # Late replies, before the next sweep or the end
+                wait_until = time.monotonic() + REPLY_WAIT
+                if deadline:
+                    wait_until = min(wait_until, deadline)
+                self.stop_event.wait(max(0, wait_until - time.monotonic()))
+        finally:
+            l2_socket.close()
 
-        if devices:
-            break  # Stop scanning once we find a device
+    def run(self, listen=0, sweep=True):
+        """Listen for listen seconds and/or sweep (after listening only the unanswered subnets), returns the
+        found devices."""
+        start = self.start_time = time.monotonic()
+        deadline = start + self.timeout if self.timeout else None
 
+        started = threading.Event()
+        sniffer = AsyncSniffer(iface=self.interface, filter=self.bpf_filter(), prn=self.handle_packet, store=False,
+                               started_callback=started.set)
+        sniffer.start()
+        started.wait()
+
+        try:
+            if listen:
+                listen_until = start + listen if not deadline else min(start + listen, deadline)
+                self.stop_event.wait(max(0, listen_until - time.monotonic()))
+                self.targets = self.unanswered_subnets()
+
+            if sweep and self.targets:
+                sender = threading.Thread(target=self.send_requests, args=(deadline,), daemon=True)
+                sender.start()
+                sender.join()
+        finally:
+            self.stop_event.set()
+            sniffer.stop()
+            self.duration = time.monotonic() - start
+
+        return list(self.devices.values())
+
+    def stats(self):
+        """Send and receive statistics of the scan."""
+        return {'sent': self.sent, 'received': self.received, 'devices': len(self.devices),
+                'duration': self.duration, 'rate': self.sent / self.duration if self.duration else 0}
+
+def load_cache(cache_file):
+    """Devices found by earlier scans, {ip: {'mac': ..., 'last_seen': ...}}."""
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache_file, cache, devices):
+    """Add the found devices to the cache, only the most recently seen CACHE_SIZE devices are kept."""
+    now = time.time()
+    for device in devices:
+        cache[device['ip']] = {'mac': device['mac'], 'last_seen': now}
+    recent = sorted(cache.items(), key=lambda item: item[1]['last_seen'], reverse=True)[:CACHE_SIZE]
+    try:
+        if os.path.dirname(cache_file):
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, 'w') as f:
+            json.dump(dict(recent), f, indent=2)
+    except OSError as e:
+        print(f"Failed to save the device cache {cache_file}: {e}")
+
+# 169.254.0.0/16
+def scan_apipa_range(interface, ip_range="169.254.4.0/24", timeout=60, rate=DEFAULT_RATE, sweeps=1, on_device=None,
+                     listen=0, sweep_unanswered=True, cache_file=None, hot_subnets=None, stats=None):
+    """Scan the APIPA range for active devices, returns the list of devices found.
+    A stats dict, when given, is filled with the scan statistics (sent, received, devices, duration, rate).
+    With listen the range is listened to passively first, and only swept (unanswered subnets) with sweep_unanswered.
+    Addresses in the cache_file (most recently seen first) and then the hot_subnets are requested before the rest."""
+
+    # Verify the interface exists before proceeding
+    if not check_interface(interface):
+        return []
+
+    cache = load_cache(cache_file) if cache_file else {}
+    priority = sorted(cache, key=lambda ip: cache[ip]['last_seen'], reverse=True)
+
+    sweep = ArpSweep(interface, ip_range, rate, sweeps, timeout, on_device, priority, hot_subnets)
+    devices = sweep.run(listen, sweep=not listen or sweep_unanswered)
+    if cache_file:
+        save_cache(cache_file, cache, devices)
+    if stats is not None:
+        stats.update(sweep.stats())
     return devices
 
 def matching_ip_address_suggestion(target_ip):
@@ -74,9 +272,19 @@ if __name__ == "__main__":
     arg_parser.add_argument('--timeout',  required=False, type=int, action='store', help='Timeout in seconds')
     arg_parser.add_argument('--ip_range',  required=False, type=int, action='store', help='IP range to scan, Supported: 16,24')
     arg_parser.add_argument('--suggest_address',  required=False,  action='store_true', help='Suggest a matching IP address to results')
+    arg_parser.add_argument('--rate',  required=False, type=int, action='store', default=DEFAULT_RATE, help='ARP requests sent per second')
+    arg_parser.add_argument('--sweeps',  required=False, type=int, action='store', default=1, help='Number of times the range is swept')
+    arg_parser.add_argument('--passive',  required=False, type=int, action='store', default=0, help='Only listen for ARP from the range for N seconds, no requests sent')
+    arg_parser.add_argument('--sweep_unanswered',  required=False,  action='store_true', help='After --passive, sweep the /24 subnets nothing was heard from')
+    arg_parser.add_argument('--hot_subnets',  required=False, type=ipaddress.ip_network, action='store', nargs='+', help='Subnets swept first (after cached addresses), e.g. 169.254.4.0/24')
+    arg_parser.add_argument('--cache',  required=False, type=str, action='store', default=DEFAULT_CACHE, help=f'File of the devices found before, swept first (default {DEFAULT_CACHE})')
+    arg_parser.add_argument('--no_cache',  required=False,  action='store_true', help='Don\'t use or update the device cache')
 
     args = arg_parser.parse_args()
 
+    if args.rate <= 0:
+        arg_parser.error('--rate must be a positive number of requests per second')
+
     # Catch ctrl +x signal
     signal.signal(signal.SIGINT, signal_handler)
 
@@ -108,7 +316,17 @@ if __name__ == "__main__":
 
     print(f"Scanning APIPA range on interface {interface} in range {ip_range} with {timeout}s timeout.")
 
-    devices = scan_apipa_range(interface, ip_range, timeout)
+    stats = {}
+    devices = scan_apipa_range(interface, ip_range, timeout, args.rate, args.sweeps,
+                               on_device=lambda device: print(f"Found IP: {device['ip']}, MAC: {device['mac']} "
+                                                              f"({device['seen_by']}, after {device['found_after']:.1f}s)"),
+                               listen=args.passive, sweep_unanswered=args.sweep_unanswered,
+                               cache_file=None if args.no_cache else args.cache, hot_subnets=args.hot_subnets,
+                               stats=stats)
+
+    if stats:
+        print(f"Sent {stats['sent']} ARP requests in {stats['duration']:.1f}s ({stats['rate']:.0f}/s), "
+              f"received {stats['received']} ARP packets from {stats['devices']} devices.")
 
     if devices:
         print("Found devices:")
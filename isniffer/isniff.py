@@ -4,19 +4,820 @@
 # Author: dherslof
 
 import argparse
+import asyncio
+import collections
+import ctypes
+import ctypes.util
+import datetime
+import functools
+import heapq
+import ipaddress
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import re
+import socket
+import struct
+import sys
+import threading
 import time
-import pyshark # pip3 install pyshark
+
+try:
+   import pyshark # pip3 install pyshark
+except ImportError:
+   # Only needed for the pyshark capture (--details or a display filter), see use_raw_socket()
+   pyshark = None
+
+# Packets waiting for output, packets captured while it's full are dropped (and counted)
+QUEUE_SIZE = 10000
+# Packets waiting to be written to the storage file, same when it's full
+WRITE_QUEUE_SIZE = 10000
+
+# Flow statistics (--stats), flows not seen for the longest time are dropped from a full table
+FLOW_TABLE_SIZE = 100000
+STATS_TOP = 10
+STATS_INTERVAL = 2.0
+
+# Capture metrics (--metrics), latency percentiles are over the last LATENCY_SAMPLES packets of an interval
+METRICS_INTERVAL = 10.0
+LATENCY_SAMPLES = 10000
+LATENCY_PERCENTILES = (0.5, 0.9, 0.99)
+
+# Raw socket capture
+ETH_P_ALL = 0x0003
+ARPHRD_LOOPBACK = 772
+RAW_SOCKET_BUFFER = 4 * 1024 * 1024
+RAW_MAX_FRAME = 65535
+# How often a blocked read checks the timeout
+RAW_POLL_INTERVAL = 0.2
+SO_ATTACH_FILTER = getattr(socket, 'SO_ATTACH_FILTER', 26)
+SOL_PACKET = getattr(socket, 'SOL_PACKET', 263)
+PACKET_STATISTICS = 6
+DLT_EN10MB = 1
+PCAP_NETMASK_UNKNOWN = 0xFFFFFFFF
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_ARP = 0x0806
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+IP_PROTOCOLS = {1: 'ICMP', 2: 'IGMP', 6: 'TCP', 17: 'UDP', 58: 'ICMPV6', 132: 'SCTP'}
+# IPv6 extension headers skipped to get to the transport header
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+IPV6_FRAGMENT_HEADER = 44
+
+# Link types of capture files (and raw sockets, always Ethernet)
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+# Capture files
+PCAP_MAGIC = {b'\xd4\xc3\xb2\xa1': ('<', 1e-6), b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+              b'\x4d\x3c\xb2\xa1': ('<', 1e-9), b'\xa1\xb2\x3c\x4d': ('>', 1e-9)}
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+PCAPNG_BYTE_ORDER_MAGIC = b'\x4d\x3c\x2b\x1a'
+PCAPNG_INTERFACE_BLOCK = 1
+PCAPNG_SIMPLE_PACKET_BLOCK = 3
+PCAPNG_ENHANCED_PACKET_BLOCK = 6
+PCAPNG_OPTION_TSRESOL = 9
+READ_BUFFER = 1024 * 1024
+# Written captures are flushed to disk in blocks of this size
+WRITE_BUFFER = 4 * 1024 * 1024
+# Part of a capture file decoded by one process with --jobs
+READ_CHUNK_SIZE = 8 * 1024 * 1024
+
+_UINT16 = struct.Struct('!H')
+_PORTS = struct.Struct('!HH')
+_PCAP_HEADER = struct.Struct('=IHHiIII')
+_PCAP_RECORD = struct.Struct('=IIII')
+
+# What is printed for a packet, the same for both capture engines.
+# src_port/dst_port are None for other than TCP/UDP, src_addr/dst_addr for other than IP
+PacketInfo = collections.namedtuple('PacketInfo', ['timestamp', 'high_layer', 'protocol', 'src_addr', 'src_port',
+                                                   'dst_addr', 'dst_port', 'length', 'interface'], defaults=(None,))
+
+
+# Decode a frame into a PacketInfo, with struct on a memoryview so nothing is copied
+def decode_frame(timestamp, frame, link_type=LINKTYPE_ETHERNET):
+   view = memoryview(frame)
+   length = len(frame)
+   try:
+      if link_type == LINKTYPE_ETHERNET:
+         ethertype = _UINT16.unpack_from(view, 12)[0]
+         offset = 14
+      elif link_type == LINKTYPE_LINUX_SLL:
+         ethertype = _UINT16.unpack_from(view, 14)[0]
+         offset = 16
+      elif link_type == LINKTYPE_LINUX_SLL2:
+         ethertype = _UINT16.unpack_from(view, 0)[0]
+         offset = 20
+      elif link_type == LINKTYPE_RAW:
+         ethertype = ETHERTYPE_IPV6 if view[0] >> 4 == 6 else ETHERTYPE_IPV4
+         offset = 0
+      else:
+         return PacketInfo(timestamp, 'LINKTYPE_{}'.format(link_type), None, None, None, None, None, length)
+
+      while ethertype in ETHERTYPE_VLAN:
+         ethertype = _UINT16.unpack_from(view, offset + 2)[0]
+         offset += 4
+
+      if ethertype == ETHERTYPE_IPV4:
+         header_length = (view[offset] & 0x0F) * 4
+         ip_protocol = view[offset + 9]
+         src_addr = socket.inet_ntop(socket.AF_INET, view[offset + 12:offset + 16])
+         dst_addr = socket.inet_ntop(socket.AF_INET, view[offset + 16:offset + 20])
+         # Only the first fragment has the transport header
+         first_fragment = (_UINT16.unpack_from(view, offset + 6)[0] & 0x1FFF) == 0
+         offset += header_length
+      elif ethertype == ETHERTYPE_IPV6:
+         ip_protocol = view[offset + 6]
+         src_addr = socket.inet_ntop(socket.AF_INET6, view[offset + 8:offset + 24])
+         dst_addr = socket.inet_ntop(socket.AF_INET6, view[offset + 24:offset + 40])
+         first_fragment = True
+         offset += 40
+         while ip_protocol in IPV6_EXTENSION_HEADERS or ip_protocol == IPV6_FRAGMENT_HEADER:
+            if ip_protocol == IPV6_FRAGMENT_HEADER:
+               first_fragment = (_UINT16.unpack_from(view, offset + 2)[0] & 0xFFF8) == 0
+               ip_protocol = view[offset]
+               offset += 8
+            else:
+               ip_protocol, extension_length = view[offset], view[offset + 1]
+               offset += (extension_length + 1) * 8
+      else:
+         high_layer = 'ARP' if ethertype == ETHERTYPE_ARP else '0x{:04x}'.format(ethertype)
+         return PacketInfo(timestamp, high_layer, None, None, None, None, None, length)
+
+      protocol = IP_PROTOCOLS.get(ip_protocol, str(ip_protocol))
+      if ip_protocol in (6, 17) and first_fragment:
+         src_port, dst_port = _PORTS.unpack_from(view, offset)
+         return PacketInfo(timestamp, protocol, protocol, src_addr, src_port, dst_addr, dst_port, length)
+      return PacketInfo(timestamp, protocol, None, src_addr, None, dst_addr, None, length)
+   except (struct.error, IndexError, ValueError):
+      # Truncated frame
+      return PacketInfo(timestamp, 'MALFORMED', None, None, None, None, None, length)
+
+
+# Streaming pcap/pcapng reader, packets are read one at a time through a large buffer
+class CaptureFileReader:
+   def __init__(self, file_name):
+      self.file_name = file_name
+      self.file = open(file_name, 'rb', buffering=READ_BUFFER)
+      magic = self.file.read(4)
+      self.pcapng = magic == PCAPNG_MAGIC
+      if self.pcapng:
+         # Set by the section header block, the first block of the file
+         self.endian = '<'
+         self.interfaces = []
+         self.data_start = 0
+      elif magic in PCAP_MAGIC:
+         self.endian, ts_unit = PCAP_MAGIC[magic]
+         header = self.file.read(20)
+         if len(header) < 20:
+            raise ValueError('{}: truncated pcap header'.format(file_name))
+         link_type = struct.unpack(self.endian + 'I', header[16:20])[0] & 0xFFFF
+         # (link type, timestamp unit) per interface, pcap files have one
+         self.interfaces = [(link_type, ts_unit)]
+         self.data_start = 24
+      else:
+         self.file.close()
+         raise ValueError('{}: not a pcap or pcapng file'.format(file_name))
+
+   def close(self):
+      self.file.close()
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, exc_type, exc_value, traceback):
+      self.close()
+
+   # Yield (timestamp, frame, link type) for the packets from offset start to end (whole file by default).
+   # A truncated last packet (file still being written) ends the file
+   def packets(self, start=None, end=None):
+      pos = self.data_start if start is None else start
+      self.file.seek(pos)
+      if self.pcapng:
+         yield from self._pcapng_packets(pos, end)
+         return
+
+      record = struct.Struct(self.endian + 'IIII')
+      link_type, ts_unit = self.interfaces[0]
+      read = self.file.read
+      while end is None or pos < end:
+         header = read(16)
+         if len(header) < 16:
+            return
+         seconds, fraction, captured_length, _ = record.unpack(header)
+         frame = read(captured_length)
+         if len(frame) < captured_length:
+            return
+         pos += 16 + captured_length
+         yield seconds + fraction * ts_unit, frame, link_type
+
+   def _pcapng_packets(self, pos, end):
+      while end is None or pos < end:
+         block_type, block_length, body = self._read_block()
+         if body is None:
+            return
+         pos += block_length
+
+         if block_type == PCAPNG_ENHANCED_PACKET_BLOCK:
+            interface, ts_high, ts_low, captured_length, _ = struct.unpack_from(self.endian + 'IIIII', body)
+            link_type, ts_unit = self._interface_of(interface)
+            yield ((ts_high << 32) | ts_low) * ts_unit, body[20:20 + captured_length], link_type
+         elif block_type == PCAPNG_SIMPLE_PACKET_BLOCK:
+            # No timestamp in a simple packet block
+            original_length = struct.unpack_from(self.endian + 'I', body)[0]
+            link_type = self._interface_of(0)[0]
+            yield 0.0, body[4:4 + min(original_length, block_length - 16)], link_type
+         elif block_type == PCAPNG_INTERFACE_BLOCK:
+            self.interfaces.append(self._interface(body))
+
+   # (link type, timestamp unit) of a packet's interface, which an interface block must have described
+   def _interface_of(self, interface):
+      if interface >= len(self.interfaces):
+         raise ValueError('{}: packet of undescribed interface {}'.format(self.file_name, interface))
+      return self.interfaces[interface]
+
+   # Read the block at the current position, returns (type, total length, body after the length field)
+   # or a None body at the end of the file. Section headers set the byte order and start a new interface list
+   def _read_block(self):
+      head = self.file.read(8)
+      if len(head) < 8:
+         return None, 0, None
+      if head[:4] == PCAPNG_MAGIC:
+         byte_order = self.file.read(4)
+         self.endian = '<' if byte_order == PCAPNG_BYTE_ORDER_MAGIC else '>'
+         self.interfaces = []
+         block_length = struct.unpack(self.endian + 'I', head[4:])[0]
+         body = byte_order + self.file.read(block_length - 12)
+      else:
+         block_type, block_length = struct.unpack(self.endian + 'II', head)
+         body = self.file.read(block_length - 8)
+      if block_length < 12 or len(body) < block_length - 8:
+         return None, 0, None
+      return struct.unpack(self.endian + 'I', head[:4])[0], block_length, body
+
+   def _interface(self, body):
+      link_type = struct.unpack_from(self.endian + 'H', body)[0]
+      ts_unit = 1e-6
+      # Options after link type, reserved and snapshot length, up to the trailing block length
+      pos = 8
+      while pos + 4 <= len(body) - 4:
+         code, length = struct.unpack_from(self.endian + 'HH', body, pos)
+         if code == 0:
+            break
+         if code == PCAPNG_OPTION_TSRESOL and length >= 1:
+            resolution = body[pos + 4]
+            ts_unit = 2 ** -(resolution & 0x7F) if resolution & 0x80 else 10 ** -resolution
+         pos += 4 + (length + 3) // 4 * 4
+      return (link_type, ts_unit)
+
+   # Split the file in parts of about chunk_size bytes, at packet boundaries. Only the packet headers are
+   # read (and the pcapng section and interface blocks, which change the reader state), packets are skipped.
+   # Returns (start, end, state) per part, with the reader state needed to decode it on its own
+   def chunks(self, chunk_size=READ_CHUNK_SIZE):
+      chunks = []
+      pos = start = self.data_start
+      self.file.seek(pos)
+      state = (self.endian, list(self.interfaces))
+      while True:
+         if self.pcapng:
+            head = self.file.read(8)
+            if len(head) < 8:
+               break
+            block_type, block_length = struct.unpack(self.endian + 'II', head)
+            if head[:4] == PCAPNG_MAGIC or block_type == PCAPNG_INTERFACE_BLOCK:
+               self.file.seek(pos)
+               block_type, block_length, body = self._read_block()
+               if body is None:
+                  break
+               if block_type == PCAPNG_INTERFACE_BLOCK:
+                  self.interfaces.append(self._interface(body))
+            elif block_length < 12:
+               break
+            pos += block_length
+            self.file.seek(pos)
+         else:
+            header = self.file.read(16)
+            if len(header) < 16:
+               break
+            captured_length = struct.unpack(self.endian + 'IIII', header)[2]
+            pos += 16 + captured_length
+            self.file.seek(pos)
+
+         if pos - start >= chunk_size:
+            chunks.append((start, pos, state))
+            start = pos
+            state = (self.endian, list(self.interfaces))
+      if pos > start:
+         chunks.append((start, pos, state))
+      return chunks
+
+
+# Count the flows in one part of a capture file, run in a worker process with --jobs. Only the flow
+# table goes back to the main process, sending every decoded packet costs more than decoding it
+def count_file_chunk(task):
+   file_name, start, end, (endian, interfaces), max_flows = task
+   stats = FlowStats(max_flows=max_flows)
+   with CaptureFileReader(file_name) as reader:
+      reader.endian = endian
+      reader.interfaces = interfaces
+      for packet in reader.packets(start, end):
+         stats.add(decode_frame(*packet))
+   return stats
+
+
+# Capture file in (classic) pcap format, for the raw socket capture
+class PcapWriter:
+   def __init__(self, file_name):
+      self.file = open(file_name, 'wb', buffering=WRITE_BUFFER)
+      # Magic, version 2.4, GMT offset, timestamp accuracy, snapshot length, link type Ethernet
+      self.file.write(_PCAP_HEADER.pack(0xA1B2C3D4, 2, 4, 0, 0, RAW_MAX_FRAME, 1))
+      self.size = _PCAP_HEADER.size
+
+   def write(self, timestamp, frame):
+      seconds = int(timestamp)
+      microseconds = round((timestamp - seconds) * 1000000)
+      if microseconds == 1000000:
+         seconds += 1
+         microseconds = 0
+      self.file.write(_PCAP_RECORD.pack(seconds, microseconds, len(frame), len(frame)))
+      self.file.write(frame)
+      self.size += _PCAP_RECORD.size + len(frame)
+
+   def close(self):
+      self.file.close()
+
+
+# Ring buffer of pcap files, a new file is started after max_size bytes and/or duration seconds and only the
+# last max_files are kept (all without max_files). Files are named like tshark's: <name>_00001_20240101120000.pcap
+class RingPcapWriter:
+   def __init__(self, file_name, max_size=0, duration=0, max_files=0):
+      self.base_name, self.extension = os.path.splitext(file_name)
+      self.extension = self.extension or '.pcap'
+      self.max_size = max_size
+      self.duration = duration
+      self.max_files = max_files
+      self.file_names = collections.deque()
+      self.index = 0
+      self.writer = None
+      self.opened = None
+      self.next_file()
+
+   def next_file(self):
+      if self.writer:
+         self.writer.close()
+      self.index += 1
+      file_name = '{}_{:05d}_{}{}'.format(self.base_name, self.index, time.strftime('%Y%m%d%H%M%S'), self.extension)
+      self.writer = PcapWriter(file_name)
+      self.opened = time.monotonic()
+      self.file_names.append(file_name)
+      while self.max_files and len(self.file_names) > self.max_files:
+         try:
+            os.remove(self.file_names.popleft())
+         except FileNotFoundError:
+            pass
+
+   def write(self, timestamp, frame):
+      if ((self.max_size and self.writer.size >= self.max_size) or
+          (self.duration and time.monotonic() - self.opened >= self.duration)):
+         self.next_file()
+      self.writer.write(timestamp, frame)
+
+   def close(self):
+      self.writer.close()
+
+
+# Writes to a PcapWriter or RingPcapWriter in its own thread, so writing and starting ring buffer files never
+# holds up the capture loop. Packets arriving while the bounded queue is full are dropped (and counted)
+class ThreadedWriter:
+   def __init__(self, writer, queue_size=WRITE_QUEUE_SIZE):
+      self.writer = writer
+      self.queue = queue.Queue(maxsize=queue_size)
+      self.dropped = 0
+      self.error = None
+      self.thread = threading.Thread(target=self.write_worker, daemon=True)
+      self.thread.start()
+
+   def write(self, timestamp, frame):
+      try:
+         self.queue.put_nowait((timestamp, frame))
+      except queue.Full:
+         if self.dropped == 0:
+            print('Storage file can\'t keep up, dropping packets')
+         self.dropped += 1
+
+   # Writes the queued packets until it gets None. After a failed write (disk full) the rest is only drained
+   def write_worker(self):
+      while True:
+         packet = self.queue.get()
+         if packet is None:
+            return
+         if self.error is None:
+            try:
+               self.writer.write(*packet)
+            except OSError as e:
+               self.error = e
+               print('Writing the storage file failed: {}'.format(e))
+
+   # Writes what's left in the queue before closing the file
+   def close(self):
+      self.queue.put(None)
+      self.thread.join()
+      self.writer.close()
+      if self.dropped:
+         print('Packets not written to the storage file: {}'.format(self.dropped))
+
+
+# Capture (BPF) filters, compiled by libpcap (which tshark uses too) and attached to the raw socket
+class _BpfInstruction(ctypes.Structure):
+   _fields_ = [('code', ctypes.c_ushort), ('jt', ctypes.c_ubyte), ('jf', ctypes.c_ubyte), ('k', ctypes.c_uint32)]
+
+class _BpfProgram(ctypes.Structure):
+   _fields_ = [('bf_len', ctypes.c_uint), ('bf_insns', ctypes.POINTER(_BpfInstruction))]
+
+class _SockFprog(ctypes.Structure):
+   _fields_ = [('len', ctypes.c_ushort), ('filter', ctypes.POINTER(_BpfInstruction))]
+
+# Compile a capture filter for Ethernet into a list of (code, jt, jf, k). Raises ValueError when libpcap
+# isn't found or the filter is invalid
+def compile_bpf(capture_filter):
+   library = ctypes.util.find_library('pcap')
+   if library is None:
+      raise ValueError('libpcap not found')
+   pcap = ctypes.CDLL(library)
+   pcap.pcap_open_dead.restype = ctypes.c_void_p
+   pcap.pcap_open_dead.argtypes = [ctypes.c_int, ctypes.c_int]
+   pcap.pcap_compile.argtypes = [ctypes.c_void_p, ctypes.POINTER(_BpfProgram), ctypes.c_char_p, ctypes.c_int,
+                                 ctypes.c_uint32]
+   pcap.pcap_geterr.restype = ctypes.c_char_p
+   pcap.pcap_geterr.argtypes = [ctypes.c_void_p]
+   pcap.pcap_freecode.argtypes = [ctypes.POINTER(_BpfProgram)]
+   pcap.pcap_close.argtypes = [ctypes.c_void_p]
+
+   handle = pcap.pcap_open_dead(DLT_EN10MB, RAW_MAX_FRAME)
+   program = _BpfProgram()
+   try:
+      if pcap.pcap_compile(handle, ctypes.byref(program), capture_filter.encode(), 1, PCAP_NETMASK_UNKNOWN) != 0:
+         raise ValueError(pcap.pcap_geterr(handle).decode(errors='replace'))
+      instructions = [(i.code, i.jt, i.jf, i.k) for i in program.bf_insns[:program.bf_len]]
+      pcap.pcap_freecode(ctypes.byref(program))
+      return instructions
+   finally:
+      pcap.pcap_close(handle)
+
+# Let the kernel drop the packets not matching the compiled filter before they're queued to the socket
+def attach_bpf(raw_socket, instructions):
+   program = (_BpfInstruction * len(instructions))(*[_BpfInstruction(*i) for i in instructions])
+   fprog = _SockFprog(len(instructions), program)
+   raw_socket.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, bytes(fprog))
+
+
+# Display filter fields and protocols with a capture filter equivalent, see display_filter_to_bpf()
+BPF_FIELDS = {'ip.addr': 'ip host', 'ip.src': 'ip src host', 'ip.dst': 'ip dst host',
+              'ipv6.addr': 'ip6 host', 'ipv6.src': 'ip6 src host', 'ipv6.dst': 'ip6 dst host',
+              'eth.addr': 'ether host', 'eth.src': 'ether src host', 'eth.dst': 'ether dst host',
+              'tcp.port': 'tcp port', 'tcp.srcport': 'tcp src port', 'tcp.dstport': 'tcp dst port',
+              'udp.port': 'udp port', 'udp.srcport': 'udp src port', 'udp.dstport': 'udp dst port'}
+BPF_PROTOCOLS = {'ip': 'ip', 'ipv6': 'ip6', 'arp': 'arp', 'tcp': 'tcp', 'udp': 'udp', 'icmp': 'icmp',
+                 'icmpv6': 'icmp6', 'igmp': 'igmp', 'sctp': 'sctp'}
+BPF_OPERATORS = {'and': 'and', '&&': 'and', 'or': 'or', '||': 'or'}
+_FILTER_TOKEN = re.compile(r'\s*(\(|\)|&&|\|\||==|!|[\w.:/-]+)')
+_MAC_ADDRESS = re.compile(r'^[0-9a-fA-F]{2}([:-][0-9a-fA-F]{2}){5}$')
+
+def _bpf_value(field, value):
+   if field.endswith('port'):
+      if value.isdigit() and int(value) <= 0xFFFF:
+         return value
+   elif field.startswith('eth.'):
+      if _MAC_ADDRESS.match(value):
+         return value.replace('-', ':')
+   else:
+      try:
+         network = ipaddress.ip_network(value, strict=False)
+      except ValueError:
+         return None
+      if network.version == (6 if field.startswith('ipv6.') else 4):
+         return str(network) if '/' in value else value
+   return None
+
+# Translate a simple display filter (protocols, addresses and ports combined with and/or/not) into the
+# same capture filter, so it can be applied in the kernel. Returns None for anything else
+def display_filter_to_bpf(display_filter):
+   tokens = []
+   position = 0
+   display_filter = display_filter.strip()
+   while position < len(display_filter):
+      match = _FILTER_TOKEN.match(display_filter, position)
+      if not match:
+         return None
+      tokens.append(match.group(1))
+      position = match.end()
+
+   def parse_expression(index):
+      # Mixed and/or without parentheses are left to tshark, the precedence differs between the two
+      operands, operator = [], None
+      while True:
+         operand, index = parse_operand(index)
+         operands.append(operand)
+         if index == len(tokens) or tokens[index] == ')':
+            return ' {} '.format(operator).join(operands), index
+         if tokens[index] not in BPF_OPERATORS or operator not in (None, BPF_OPERATORS[tokens[index]]):
+            raise ValueError(tokens[index])
+         operator = BPF_OPERATORS[tokens[index]]
+         index += 1
+
+   def parse_operand(index):
+      token = tokens[index]
+      if token in ('not', '!'):
+         operand, index = parse_operand(index + 1)
+         return 'not {}'.format(operand), index
+      if token == '(':
+         expression, index = parse_expression(index + 1)
+         if index == len(tokens) or tokens[index] != ')':
+            raise ValueError('(')
+         return '({})'.format(expression), index + 1
+      if token in BPF_PROTOCOLS:
+         return BPF_PROTOCOLS[token], index + 1
+      if token in BPF_FIELDS and tokens[index + 1:index + 2] in (['=='], ['eq']):
+         value = _bpf_value(token, tokens[index + 2])
+         if value is not None:
+            primitive = BPF_FIELDS[token]
+            if '/' in value:
+               primitive = primitive.replace('host', 'net')
+            return '({} {})'.format(primitive, value), index + 3
+      raise ValueError(token)
+
+   try:
+      expression, index = parse_expression(0)
+   except (ValueError, IndexError):
+      return None
+   if index != len(tokens):
+      return None
+   return expression
+
+
+# Scaled number for the statistics, 1234567 -> '1.2M'
+def si_format(value):
+   for prefix in ('', 'k', 'M', 'G'):
+      if value < 1000:
+         break
+      value /= 1000
+   else:
+      prefix = 'T'
+   return '{:.0f}{}'.format(value, prefix) if prefix == '' else '{:.1f}{}'.format(value, prefix)
+
+
+# Packets and bytes per flow (both directions of a conversation) in a table of at most max_flows,
+# ordered by last seen so the least recently seen flow is the one dropped (LRU)
+class FlowStats:
+   def __init__(self, top=STATS_TOP, interval=STATS_INTERVAL, max_flows=FLOW_TABLE_SIZE):
+      self.top = top
+      self.interval = interval
+      self.max_flows = max_flows
+      # key -> [packets, bytes, first seen, last seen]
+      self.flows = collections.OrderedDict()
+      self.evicted = 0
+      self.packets = 0
+      self.bytes = 0
+      self.first_seen = None
+      self.last_seen = None
+      # Rates are over the packets since the previous report
+      self.report_time = time.monotonic()
+      self.report_packets = 0
+      self.report_bytes = 0
+
+   @staticmethod
+   def flow_key(info):
+      protocol = info.protocol or info.high_layer
+      src = (info.src_addr, info.src_port)
+      dst = (info.dst_addr, info.dst_port)
+      # Same key for both directions
+      if (str(info.src_addr), str(info.src_port)) > (str(info.dst_addr), str(info.dst_port)):
+         src, dst = dst, src
+      return (protocol, src, dst)
+
+   def add(self, info):
+      self.packets += 1
+      self.bytes += info.length
+      if self.first_seen is None:
+         self.first_seen = info.timestamp
+      self.last_seen = info.timestamp
+
+      key = self.flow_key(info)
+      flow = self.flows.get(key)
+      if flow is None:
+         if len(self.flows) >= self.max_flows:
+            self.flows.popitem(last=False)
+            self.evicted += 1
+         self.flows[key] = [1, info.length, info.timestamp, info.timestamp]
+         return
+      self.flows.move_to_end(key)
+      flow[0] += 1
+      flow[1] += info.length
+      flow[3] = info.timestamp
+
+   # Add the counts of a table of later packets, like the next part of a file counted by another process
+   def merge(self, other):
+      self.packets += other.packets
+      self.bytes += other.bytes
+      self.evicted += other.evicted
+      if other.first_seen is not None:
+         if self.first_seen is None:
+            self.first_seen = other.first_seen
+         self.last_seen = other.last_seen
+
+      for key, (packets, data, first_seen, last_seen) in other.flows.items():
+         flow = self.flows.get(key)
+         if flow is None:
+            if len(self.flows) >= self.max_flows:
+               self.flows.popitem(last=False)
+               self.evicted += 1
+            self.flows[key] = [packets, data, first_seen, last_seen]
+            continue
+         self.flows.move_to_end(key)
+         flow[0] += packets
+         flow[1] += data
+         flow[3] = last_seen
+
+   @staticmethod
+   def endpoint(address, port):
+      if address is None:
+         return '-'
+      if port is None:
+         return address
+      return '[{}]:{}'.format(address, port) if ':' in address else '{}:{}'.format(address, port)
+
+   # Top flows by bytes, with the package and bit rate since the previous report
+   def report(self, final=False):
+      now = time.monotonic()
+      elapsed = now - self.report_time
+      packets = self.packets - self.report_packets
+      data = self.bytes - self.report_bytes
+      self.report_time, self.report_packets, self.report_bytes = now, self.packets, self.bytes
+
+      if final:
+         # Over the whole capture by the packet timestamps, also right for files
+         elapsed = (self.last_seen - self.first_seen) if self.packets > 1 else 0
+         packets, data = self.packets, self.bytes
+      pps = packets / elapsed if elapsed > 0 else 0
+      bps = data * 8 / elapsed if elapsed > 0 else 0
+
+      rows = [('Protocol', 'Endpoint A', 'Endpoint B', 'Packets', 'Bytes', 'First seen', 'Last seen')]
+      for (protocol, src, dst), flow in heapq.nlargest(self.top, self.flows.items(), key=lambda item: item[1][1]):
+         rows.append((protocol, self.endpoint(*src), self.endpoint(*dst), flow[0], si_format(flow[1]),
+                      datetime.datetime.fromtimestamp(flow[2]).strftime('%H:%M:%S.%f')[:12],
+                      datetime.datetime.fromtimestamp(flow[3]).strftime('%H:%M:%S.%f')[:12]))
+      width = max(len(row[1]) for row in rows + [(None, row[2]) for row in rows])
+      row_format = '{:<8} {:<%d} {:<%d} {:>8} {:>8} {:<12} {:<12}' % (width, width)
+
+      lines = ['{} - packets: {}, bytes: {}, flows: {} (evicted {}), {}pps, {}bps'.format(
+                  'Total' if final else datetime.datetime.now().strftime('%H:%M:%S'), self.packets,
+                  si_format(self.bytes), len(self.flows), self.evicted, si_format(pps), si_format(bps))]
+      lines.extend(row_format.format(*row) for row in rows)
+
+      # Refresh the table in place on a terminal
+      if not final and sys.stdout.isatty():
+         print('\033[H\033[J', end='')
+      print('\n'.join(lines), flush=True)
+
+# Capture performance, reported every interval as JSON lines (appended, '-' for stderr) or as a Prometheus
+# textfile (replaced, for the node exporter's textfile collector)
+class CaptureMetrics:
+   def __init__(self, file_name='-', output_format='json', interval=METRICS_INTERVAL):
+      self.file_name = file_name
+      self.output_format = output_format
+      self.interval = interval
+      # Seconds from capture to output of the latest packets
+      self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+      # Taken by the output worker appending and the report taking the samples of the interval
+      self.latencies_lock = threading.Lock()
+      self.report_time = time.monotonic()
+      self.report_received = 0
+      self.report_processed = 0
+
+   # Called by the output worker for each packet, with the capture time of the packet
+   def processed(self, timestamp):
+      with self.latencies_lock:
+         self.latencies.append(time.time() - timestamp)
+
+   def latency_percentiles(self):
+      # Samples added while sorting go to the next interval
+      with self.latencies_lock:
+         latencies, self.latencies = self.latencies, collections.deque(maxlen=LATENCY_SAMPLES)
+      latencies = sorted(latencies)
+      if not latencies:
+         return {}
+      values = {'p{:g}'.format(p * 100): latencies[int(p * (len(latencies) - 1))] for p in LATENCY_PERCENTILES}
+      values['max'] = latencies[-1]
+      return values
+
+   def report(self, sniffer):
+      now = time.monotonic()
+      elapsed = now - self.report_time
+      kernel_packets, kernel_drops = sniffer.read_kernel_stats()
+      values = collections.OrderedDict([
+         ('time', time.time()),
+         ('packets_received', sniffer.captured),
+         ('packets_processed', sniffer.printed),
+         ('packets_dropped', sniffer.dropped),
+         ('kernel_packets', kernel_packets),
+         ('kernel_drops', kernel_drops),
+         ('received_pps', (sniffer.captured - self.report_received) / elapsed if elapsed > 0 else 0),
+         ('processed_pps', (sniffer.printed - self.report_processed) / elapsed if elapsed > 0 else 0),
+         # Consumer lag, packets captured but not processed yet
+         ('queue_depth', sniffer.packet_queue.qsize() if sniffer.packet_queue else 0),
+         ('latency', self.latency_percentiles())])
+      # Capture on several interfaces
+      if sniffer.interface_counters:
+         values['interfaces'] = {interface: {'packets_received': received, 'packets_dropped': dropped}
+                                 for interface, (received, dropped) in zip(sniffer.interfaces, sniffer.interface_counters)}
+      self.report_time, self.report_received, self.report_processed = now, sniffer.captured, sniffer.printed
+
+      if self.output_format == 'prometheus':
+         self.write_prometheus(values)
+      elif self.file_name == '-':
+         print(json.dumps(values), file=sys.stderr, flush=True)
+      else:
+         with open(self.file_name, 'a') as metrics_file:
+            metrics_file.write(json.dumps(values) + '\n')
+
+   def write_prometheus(self, values):
+      lines = []
+
+      def metric(name, metric_type, help_text, samples):
+         lines.append('# HELP isniffer_{} {}'.format(name, help_text))
+         lines.append('# TYPE isniffer_{} {}'.format(name, metric_type))
+         for labels, value in samples:
+            if value is not None:
+               lines.append('isniffer_{}{} {}'.format(name, labels, value))
+
+      metric('packets_received_total', 'counter', 'Packets captured', [('', values['packets_received'])])
+      metric('packets_processed_total', 'counter', 'Packets printed or counted', [('', values['packets_processed'])])
+      metric('packets_dropped_total', 'counter', 'Packets dropped because the output couldn\'t keep up',
+             [('', values['packets_dropped'])])
+      metric('kernel_packets_total', 'counter', 'Packets seen by the kernel (raw socket capture)',
+             [('', values['kernel_packets'])])
+      metric('kernel_drops_total', 'counter', 'Packets dropped by the kernel (raw socket capture)',
+             [('', values['kernel_drops'])])
+      metric('queue_depth', 'gauge', 'Packets captured but not processed yet', [('', values['queue_depth'])])
+      # Percentiles of the last interval only, a gauge per percentile rather than a (cumulative) summary
+      metric('latency_seconds', 'gauge', 'Seconds from capture to output, percentiles over the last interval',
+             [('{{percentile="{:g}"}}'.format(p * 100), values['latency'].get('p{:g}'.format(p * 100)))
+              for p in LATENCY_PERCENTILES])
+      metric('interface_packets_received_total', 'counter', 'Packets captured per interface',
+             [('{{interface="{}"}}'.format(interface), counters['packets_received'])
+              for interface, counters in values.get('interfaces', {}).items()])
+      metric('interface_packets_dropped_total', 'counter', 'Packets dropped by the merge per interface',
+             [('{{interface="{}"}}'.format(interface), counters['packets_dropped'])
+              for interface, counters in values.get('interfaces', {}).items()])
+
+      # Replaced at once, so the collector never reads half a file
+      temporary_file = self.file_name + '.tmp'
+      with open(temporary_file, 'w') as metrics_file:
+         metrics_file.write('\n'.join(lines) + '\n')
+      os.replace(temporary_file, self.file_name)
 
 # main sniffer
 class InterfaceSniffer:
-   def __init__(self, interface, storage_file, capture_filter, counter, timeout, verbose, details):
+   def __init__(self, interface, storage_file, capture_filter, counter, timeout, verbose, details,
+                read_files=None, jobs=1, flow_stats=None, ring_size=0, ring_duration=0, ring_files=0,
+                bpf_filter=None, metrics=None):
+      # One or more interfaces, see capture_interfaces()
       self.eth_interface = interface
+      self.interfaces = [interface] if isinstance(interface, str) else list(interface or [])
       self.storage_file = storage_file
       self.capture_filter = capture_filter
       self.counter = counter
       self.timeout = timeout
       self.verbose = verbose
       self.pkg_details = details
+      self.read_files = read_files
+      self.jobs = jobs
+      self.flow_stats = flow_stats
+      # Ring buffer of storage files, size in MB and duration in seconds
+      self.ring_size = ring_size
+      self.ring_duration = ring_duration
+      self.ring_files = ring_files
+      self.bpf_filter = bpf_filter
+      self.metrics = metrics
+
+      # Capture pipeline, see capture_packets()
+      self.packet_queue = None
+      self.captured = 0
+      self.dropped = 0
+      self.printed = 0
+      self.interface_counters = []
+      # Raw sockets of the capture and what the kernel counted on the closed ones, see read_kernel_stats()
+      self.raw_sockets = []
+      self.kernel_packets = None
+      self.kernel_drops = None
+      self.kernel_stats_lock = threading.Lock()
+      self.metrics_thread = None
+      self.metrics_stop = threading.Event()
 
 # help functions for input arguments
    def with_filter(self):
@@ -25,12 +826,24 @@ class InterfaceSniffer:
       else:
          return False
 
+   def with_bpf_filter(self):
+      if self.bpf_filter:
+         return True
+      else:
+         return False
+
    def to_file(self):
       if self.storage_file:
          return True
       else:
          return False
 
+   def ring_buffer(self):
+      if self.ring_size or self.ring_duration:
+         return True
+      else:
+         return False
+
    def stop_on_timeout(self):
       if self.timeout != 0:
          return True
@@ -55,109 +868,601 @@ class InterfaceSniffer:
       else:
          return False
 
-   # Capture packages
-   def start(self):
+   def from_files(self):
+      if self.read_files:
+         return True
+      else:
+         return False
+
+   def with_metrics(self):
+      if self.metrics:
+         return True
+      else:
+         return False
+
+   def stats_mode(self):
+      if self.flow_stats:
+         return True
+      else:
+         return False
 
+   # The raw socket capture only decodes the addresses and ports, it's used when nothing more is needed
+   def use_raw_socket(self):
+      if self.print_pkg_details() or self.with_filter():
+         return False
+      return hasattr(socket, 'AF_PACKET')
+
+   # A display filter that has a capture filter equivalent is applied as that, in the kernel, instead.
+   # That also allows the raw socket capture
+   def translate_filter(self):
+      if not self.with_filter():
+         return
+      bpf_filter = display_filter_to_bpf(self.capture_filter)
+      if bpf_filter is None:
+         return
       if self.verbose_mode():
-         print('Interface: {}'.format(self.eth_interface))
+         print('Filter {} applied as capture filter: {}'.format(self.capture_filter, bpf_filter))
+      self.bpf_filter = '({}) and ({})'.format(self.bpf_filter, bpf_filter) if self.with_bpf_filter() else bpf_filter
+      self.capture_filter = None
+
+   def create_capture(self):
+      # tshark merges several interfaces itself
+      options = {'interface': self.interfaces[0] if len(self.interfaces) == 1 else self.interfaces}
 
-      capture = None
+      if self.with_bpf_filter():
+         options['bpf_filter'] = self.bpf_filter
 
       if self.with_filter():
          if self.verbose_mode():
             print('Filter: {}'.format(self.capture_filter))
+         options['display_filter'] = self.capture_filter
+
+      if self.to_file():
+         if self.verbose_mode():
+            print('Storage-file: {}'.format(self.storage_file))
+         options['output_file'] = self.storage_file
+         if self.ring_buffer():
+            # tshark's own ring buffer
+            ring_options = []
+            if self.ring_size:
+               ring_options += ['-b', 'filesize:{}'.format(self.ring_size * 1000)]
+            if self.ring_duration:
+               ring_options += ['-b', 'duration:{}'.format(self.ring_duration)]
+            if self.ring_files:
+               ring_options += ['-b', 'files:{}'.format(self.ring_files)]
+            options['custom_parameters'] = ring_options
 
-         if self.to_file():
-               if self.verbose_mode():
-                  print('Storage-file: {}'.format(self.storage_file))
+      return pyshark.LiveCapture(**options)
 
-               capture = pyshark.LiveCapture(interface=self.eth_interface, display_filter=self.capture_filter, output_file=self.storage_file)
-         else:
-            capture = pyshark.LiveCapture(interface=self.eth_interface, display_filter=self.capture_filter)
+   # Producer, called in the capture eventloop for each packet. Only queues the packet so the
+   # capture keeps up with tshark, a full queue means the output can't keep up and the packet is dropped.
+   # Files are read at the pace of the output instead (block)
+   def enqueue_packet(self, packet, block=False):
+      self.captured += 1
+      try:
+         self.packet_queue.put(packet, block)
+      except queue.Full:
+         if self.dropped == 0:
+            print('Output can\'t keep up, dropping packets')
+         self.dropped += 1
+
+   # Consumer, decodes and prints the queued packets in its own thread until it gets None
+   def output_worker(self, decode):
+      metrics = self.latency_metrics()
+      while True:
+         packet = self.packet_queue.get()
+         if packet is None:
+            return
+         info = decode(packet)
+         self.print_packet(info, packet)
+         self.printed += 1
+         if metrics:
+            metrics.processed(info.timestamp)
+
+   # Consumer in --stats mode, counts the packets per flow instead of printing them and prints the
+   # statistics every interval, also when no packets arrive
+   def stats_worker(self, decode):
+      stats = self.flow_stats
+      metrics = self.latency_metrics()
+      next_report = time.monotonic() + stats.interval
+      while True:
+         try:
+            packet = self.packet_queue.get(timeout=max(0, next_report - time.monotonic()))
+         except queue.Empty:
+            packet = False
+         if packet is None:
+            break
+         if packet is not False:
+            info = decode(packet)
+            stats.add(info)
+            self.printed += 1
+            if metrics:
+               metrics.processed(info.timestamp)
+         if time.monotonic() >= next_report:
+            stats.report()
+            next_report = time.monotonic() + stats.interval
+      stats.report(final=True)
+
+   # PacketInfo of a pyshark packet
+   @staticmethod
+   def packet_info(packet):
+      high_layer = packet.highest_layer
+      protocol = packet.transport_layer
+      timestamp = float(packet.sniff_timestamp)
+      try:
+         return PacketInfo(timestamp, high_layer, protocol, packet.ip.src, packet[protocol].srcport,
+                           packet.ip.dst, packet[protocol].dstport, int(packet.length))
+      except (AttributeError, KeyError):
+         return PacketInfo(timestamp, high_layer, protocol, None, None, None, None, int(packet.length))
+
+   def print_packet(self, info, packet):
+      if info.src_port is None:
+         # ignore packets other than TCP, UDP and IP (detailed package info doesn't exists?)
+         print('Unknown package [Highest layer: {}, Protocol: {}] '.format(info.high_layer, info.protocol))
+         return
+
+      if self.verbose_mode():
+         print('{}{} IP {}:{} <-> {}:{} ({})'.format(datetime.datetime.fromtimestamp(info.timestamp),
+                                                     ' ' + info.interface if info.interface else '', info.src_addr,
+                                                     info.src_port, info.dst_addr, info.dst_port, info.protocol))
+
+      if self.print_pkg_details():
+         print(packet)
+
+   # The latency of packets read from files is their age, only measured for captures
+   def latency_metrics(self):
+      if self.with_metrics() and not self.from_files():
+         return self.metrics
+      return None
+
+   def metrics_worker(self):
+      while not self.metrics_stop.wait(self.metrics.interval):
+         self.metrics.report(self)
+
+   # Packets seen and dropped by the kernel on the raw sockets since the start of the capture, None without
+   def read_kernel_stats(self):
+      with self.kernel_stats_lock:
+         for raw_socket in self.raw_sockets:
+            try:
+               # Reading the statistics resets them (struct tpacket_stats), so they're summed here
+               packets, drops = struct.unpack('II', raw_socket.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8))
+            except OSError:
+               continue
+            # The kernel counts the dropped packets in tp_packets too
+            self.kernel_packets = (self.kernel_packets or 0) + packets
+            self.kernel_drops = (self.kernel_drops or 0) + drops
+         return self.kernel_packets, self.kernel_drops
+
+   def close_raw_sockets(self):
+      self.read_kernel_stats()
+      with self.kernel_stats_lock:
+         for raw_socket in self.raw_sockets:
+            raw_socket.close()
+         self.raw_sockets = []
+
+   def start_output(self, decode):
+      self.packet_queue = queue.Queue(maxsize=QUEUE_SIZE)
+      target = self.stats_worker if self.stats_mode() else self.output_worker
+      worker = threading.Thread(target=target, args=(decode,), daemon=True)
+      worker.start()
+      if self.with_metrics():
+         self.metrics_stop.clear()
+         self.metrics_thread = threading.Thread(target=self.metrics_worker, daemon=True)
+         self.metrics_thread.start()
+      return worker
+
+   def stop_output(self, worker):
+      # Let the worker print what's left
+      self.packet_queue.put(None)
+      worker.join()
+
+      if self.with_metrics():
+         self.metrics_stop.set()
+         self.metrics_thread.join()
+         # Final numbers
+         self.metrics.report(self)
+
+      if self.verbose_mode() or self.dropped:
+         print('Packets captured: {}, printed: {}, dropped: {}'.format(self.captured, self.printed, self.dropped))
+
+   # Run the capture as an asyncio task in the capture's eventloop, with the output in a worker thread.
+   # Packets are streamed through the queue, also with a timeout nothing is buffered until the end
+   def capture_packets(self, capture, packet_count=None, timeout=None):
+      worker = self.start_output(self.packet_info)
+      self.run_capture(capture, packet_count, timeout)
+      self.stop_output(worker)
+
+   def run_capture(self, capture, packet_count=None, timeout=None):
+      enqueue = functools.partial(self.enqueue_packet, block=self.from_files())
+      capture_coro = capture.packets_from_tshark(enqueue, packet_count=packet_count)
+      if timeout:
+         # Cancels the capture (and stops tshark) at the deadline
+         capture_coro = asyncio.wait_for(capture_coro, timeout)
+      task = capture.eventloop.create_task(capture_coro)
+      try:
+         capture.eventloop.run_until_complete(task)
+      except asyncio.TimeoutError:
+         pass
+      except KeyboardInterrupt:
+         task.cancel()
+         capture.close()
+         raise
+
+   # Capture on a raw AF_PACKET socket instead of through tshark, the frames are queued as
+   # (timestamp, bytes) and decoded by the output worker
+   def capture_raw(self, packet_count=None, timeout=None):
+      bpf = compile_bpf(self.bpf_filter) if self.with_bpf_filter() else None
+      if len(self.interfaces) > 1:
+         self.capture_interfaces(bpf, packet_count, timeout)
+         return
+
+      raw_socket = self.open_raw_socket(self.interfaces[0], bpf)
+      self.raw_sockets = [raw_socket]
+      try:
+         writer = self.open_writer()
+      except BaseException:
+         self.close_raw_sockets()
+         raise
+      worker = self.start_output(lambda packet: decode_frame(*packet))
+      deadline = time.monotonic() + timeout if timeout else None
+      try:
+         while not packet_count or self.captured < packet_count:
+            try:
+               frame, address = raw_socket.recvfrom(RAW_MAX_FRAME)
+            except socket.timeout:
+               frame = None
+            if deadline and time.monotonic() >= deadline:
+               break
+            if frame is None:
+               continue
+            # On loopback every packet is seen going out and coming in, keep one (like libpcap)
+            if address[2] == socket.PACKET_OUTGOING and address[3] == ARPHRD_LOOPBACK:
+               continue
+
+            timestamp = time.time()
+            if writer:
+               writer.write(timestamp, frame)
+            self.enqueue_packet((timestamp, frame))
+      except KeyboardInterrupt:
+         pass
+      finally:
+         self.close_raw_sockets()
+         if writer:
+            writer.close()
+
+      self.stop_output(worker)
+
+   @staticmethod
+   def open_raw_socket(interface, bpf=None):
+      # Protocol 0 receives nothing until bound, so no packets get in before the filter is attached
+      raw_socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+      try:
+         raw_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RAW_SOCKET_BUFFER)
+         if bpf:
+            attach_bpf(raw_socket, bpf)
+         raw_socket.bind((interface, ETH_P_ALL))
+         raw_socket.settimeout(RAW_POLL_INTERVAL)
+      except BaseException:
+         raw_socket.close()
+         raise
+      return raw_socket
+
+   def open_writer(self):
+      if not self.to_file():
+         return None
+      if self.verbose_mode():
+         print('Storage-file: {}'.format(self.storage_file))
+      if self.ring_buffer():
+         writer = RingPcapWriter(self.storage_file, self.ring_size * 1000 * 1000, self.ring_duration, self.ring_files)
       else:
-         if self.to_file():
-            if self.verbose_mode():
-               print('Storage-file: {}'. format(self.storage_file))
+         writer = PcapWriter(self.storage_file)
+      return ThreadedWriter(writer)
 
-            capture = pyshark.LiveCapture(interface=self.eth_interface, output_file=self.storage_file)
-         else:
-            capture = pyshark.LiveCapture(interface=self.eth_interface)
+   # Reader thread of one interface in capture_interfaces(), puts (timestamp, index, frame) in the merge queue.
+   # Also without packets the time is put (with frame None) every poll, so the merge knows nothing older will come
+   def read_interface(self, index, raw_socket, merge_queue, stop):
+      counters = self.interface_counters[index]
 
-      if self.stop_on_counter():
-         for packet in capture.sniff_continuously(packet_count=self.counter):
-            timestamp = time.asctime(time.localtime(time.time()))
+      # Blocks while the merge is behind, but not after the capture stopped
+      def put_time(timestamp):
+         while not stop.is_set():
             try:
-               high_layer = capture[packet].highest_layer
-               protocol = packet.transport_layer
-               src_addr = packet.ip.src
-               src_port = packet[protocol].srcport
-               dst_addr = packet.ip.dst
-               dst_port = packet[protocol].dstport
-
-               if self.verbose_mode():
-                  print('{} IP {}:{} <-> {}:{} ({})'.format(timestamp, src_addr, src_port, dst_addr, dst_port, protocol))
-
-               if self.print_pkg_details():
-                  print(packet)
-
-            except AttributeError as e:
-               # ignore packets other than TCP, UDP and IPv4 (detailed package info doesn't exists?)
-               print('Unknown package [Highest layer: {}, Protocol: {}] '.format(high_layer, protocol))
+               merge_queue.put((timestamp, index, None), timeout=RAW_POLL_INTERVAL)
+               return
+            except queue.Full:
                pass
 
+      try:
+         while not stop.is_set():
+            try:
+               frame, address = raw_socket.recvfrom(RAW_MAX_FRAME)
+            except socket.timeout:
+               put_time(time.time())
+               continue
+            if address[2] == socket.PACKET_OUTGOING and address[3] == ARPHRD_LOOPBACK:
+               continue
+            counters[0] += 1
+            try:
+               merge_queue.put_nowait((time.time(), index, frame))
+            except queue.Full:
+               counters[1] += 1
+      except OSError as e:
+         print('Capture on {} failed: {}'.format(self.interfaces[index], e))
+      finally:
+         # Don't hold back the other interfaces
+         put_time(float('inf'))
+
+   # Capture on several interfaces, each in its own reader thread. The packets are merged into one stream
+   # in timestamp order with a heap: a packet is passed on when every interface has reached its timestamp
+   def capture_interfaces(self, bpf, packet_count=None, timeout=None):
+      sockets = []
+      try:
+         for interface in self.interfaces:
+            sockets.append(self.open_raw_socket(interface, bpf))
+         self.raw_sockets = list(sockets)
+         writer = self.open_writer()
+      except BaseException:
+         # Don't leave the sockets opened so far behind, e.g. when a later interface doesn't exist
+         for raw_socket in sockets:
+            raw_socket.close()
+         self.raw_sockets = []
+         raise
+      # Packets and packets dropped (merge can't keep up) per interface
+      self.interface_counters = [[0, 0] for _ in self.interfaces]
+      merge_queue = queue.Queue(maxsize=QUEUE_SIZE)
+      stop = threading.Event()
+      readers = [threading.Thread(target=self.read_interface, args=(index, raw_socket, merge_queue, stop), daemon=True)
+                 for index, raw_socket in enumerate(sockets)]
+      for reader in readers:
+         reader.start()
+
+      names = self.interfaces
+      worker = self.start_output(lambda packet: decode_frame(packet[0], packet[2])._replace(interface=names[packet[1]]))
+      deadline = time.monotonic() + timeout if timeout else None
+      heap = []
+      # The sequence number keeps the order of equal timestamps (and frames are never compared)
+      sequence = itertools.count()
+      reached = [0.0] * len(sockets)
+      try:
+         while not packet_count or self.captured < packet_count:
+            if deadline and time.monotonic() >= deadline:
+               break
+            try:
+               timestamp, index, frame = merge_queue.get(timeout=RAW_POLL_INTERVAL)
+            except queue.Empty:
+               continue
+            reached[index] = timestamp
+            if frame is not None:
+               heapq.heappush(heap, (timestamp, next(sequence), index, frame))
+            if min(reached) == float('inf') and not heap:
+               break
+            oldest = min(reached)
+            while heap and heap[0][0] <= oldest and (not packet_count or self.captured < packet_count):
+               timestamp, _, index, frame = heapq.heappop(heap)
+               if writer:
+                  writer.write(timestamp, frame)
+               self.enqueue_packet((timestamp, index, frame))
+      except KeyboardInterrupt:
+         pass
+      finally:
+         stop.set()
+         for reader in readers:
+            reader.join()
+         self.close_raw_sockets()
+
+      # What's left in the heap (and queue) is still in order
+      while not merge_queue.empty():
+         timestamp, index, frame = merge_queue.get()
+         if frame is not None:
+            heapq.heappush(heap, (timestamp, next(sequence), index, frame))
+      while heap and (not packet_count or self.captured < packet_count):
+         timestamp, _, index, frame = heapq.heappop(heap)
+         if writer:
+            writer.write(timestamp, frame)
+         self.enqueue_packet((timestamp, index, frame))
+      if writer:
+         writer.close()
+
+      self.stop_output(worker)
+      for interface, (captured, dropped) in zip(self.interfaces, self.interface_counters):
+         if self.verbose_mode() or dropped:
+            print('{}: packets captured: {}, dropped: {}'.format(interface, captured, dropped))
+
+   # Read capture files with pyshark, one after the other
+   def read_files_pyshark(self, packet_count=None):
+      worker = self.start_output(self.packet_info)
+      try:
+         for file_name in self.read_files:
+            options = {'display_filter': self.capture_filter} if self.with_filter() else {}
+            capture = pyshark.FileCapture(file_name, **options)
+            self.run_capture(capture, packet_count - self.captured if packet_count else None)
+            if packet_count and self.captured >= packet_count:
+               break
+      except KeyboardInterrupt:
+         pass
+      self.stop_output(worker)
+
+   # Read capture files with the own reader
+   def read_files_raw(self, packet_count=None):
+      if self.jobs > 1 and self.stats_mode() and not packet_count:
+         self.count_files()
+         return
+
+      worker = self.start_output(lambda info: info)
+      try:
+         for info in (decode_frame(*packet) for packet in self.read_packets()):
+            self.enqueue_packet(info, block=True)
+            if packet_count and self.captured >= packet_count:
+               break
+      except KeyboardInterrupt:
+         pass
+      self.stop_output(worker)
+
+   # --stats over the read files with more than one job. The files are split in parts, each counted by a
+   # process of the pool, and the flow tables are merged here in file order
+   def count_files(self):
+      stats = self.flow_stats
+      tasks = []
+      for file_name in self.read_files:
+         with CaptureFileReader(file_name) as reader:
+            tasks.extend((file_name,) + chunk + (stats.max_flows,) for chunk in reader.chunks())
+
+      next_report = time.monotonic() + stats.interval
+      pool = multiprocessing.Pool(self.jobs)
+      try:
+         for part in pool.imap(count_file_chunk, tasks):
+            stats.merge(part)
+            self.captured += part.packets
+            self.printed += part.packets
+            if time.monotonic() >= next_report:
+               stats.report()
+               next_report = time.monotonic() + stats.interval
+      except KeyboardInterrupt:
+         pass
+      finally:
+         pool.terminate()
+      stats.report(final=True)
+
+      if self.with_metrics():
+         self.metrics.report(self)
+      if self.verbose_mode():
+         print('Packets captured: {}, printed: {}, dropped: {}'.format(self.captured, self.printed, self.dropped))
+
+   def read_packets(self):
+      for file_name in self.read_files:
+         with CaptureFileReader(file_name) as reader:
+            yield from reader.packets()
+
+   def read(self):
+      if self.verbose_mode():
+         print('Reading: {}'.format(', '.join(self.read_files)))
+      packet_count = self.counter if self.stop_on_counter() else None
+
+      if self.print_pkg_details() or self.with_filter():
+         if pyshark is None:
+            print('pyshark is needed for --details and --filter (pip3 install pyshark)')
+            return
+         self.read_files_pyshark(packet_count)
          return
 
+      try:
+         self.read_files_raw(packet_count)
+      except (OSError, ValueError) as e:
+         print('Failed to read capture file: {}'.format(e))
+
+   # Capture packages
+   def start(self):
+      if self.from_files():
+         self.read()
+         return
+
+      if self.verbose_mode():
+         print('Interface: {}'.format(', '.join(self.interfaces)))
+
       if self.stop_on_timeout():
          print('Timeout: {}'.format(self.timeout))
-         capture.sniff(timeout=self.timeout)
-         capture.close()
 
-         # summarize (dev purpose)
-         #print('{}'.format(capture))
+      self.translate_filter()
+      if self.with_bpf_filter() and self.verbose_mode():
+         print('Capture filter: {}'.format(self.bpf_filter))
 
-         for packet in range(0, len(capture)):
-            try:
-               high_layer = capture[packet].highest_layer
-               protocol = capture[packet].transport_layer
-               src_addr = capture[packet].ip.src
-               src_port = capture[packet][protocol].srcport
-               dst_addr = capture[packet].ip.dst
-               dst_port = capture[packet][protocol].dstport
-               timestamp = capture[packet].sniff_time
-
-               if self.verbose_mode():
-                  print('{} IP {}:{} <-> {}:{} ({})'.format(timestamp, src_addr, src_port, dst_addr, dst_port, protocol))
-
-               if self.print_pkg_details():
-                  print(packet)
-
-            except AttributeError as e:
-               print('Unknown package [Highest layer: {}, Protocol: {}] '.format(high_layer, protocol))
-               pass
+      # Until the counter or the timeout is reached, whichever comes first, or forever (Ctrl+C) without them
+      packet_count = self.counter if self.stop_on_counter() else None
+      timeout = self.timeout if self.stop_on_timeout() else None
 
+      if self.use_raw_socket():
+         if self.verbose_mode():
+            print('Capture: raw socket')
+         try:
+            self.capture_raw(packet_count, timeout)
+            return
+         except PermissionError:
+            if pyshark is None:
+               print('No permission to open a raw socket (run as root, or pip3 install pyshark)')
+               return
+            # tshark (dumpcap) may have the capture permission when this user doesn't
+            print('No permission to open a raw socket, capturing with pyshark')
+         except ValueError as e:
+            if pyshark is None:
+               print('Capture filter needs libpcap (libpcap.so) or pyshark (pip3 install pyshark): {}'.format(e))
+               return
+            print('Failed to compile the capture filter ({}), capturing with pyshark'.format(e))
+         except OSError as e:
+            print('Failed to capture on {}: {}'.format(', '.join(self.interfaces), e))
+            return
+
+      if pyshark is None:
+         if self.print_pkg_details() or self.with_filter():
+            print('pyshark is needed for --details and --filter (pip3 install pyshark)')
+         else:
+            print('pyshark is needed to capture without a raw socket (pip3 install pyshark)')
          return
 
+      capture = self.create_capture()
+      try:
+         self.capture_packets(capture, packet_count, timeout)
+      except KeyboardInterrupt:
+         pass
+
 if __name__ == "__main__":
 
    arg_parser = argparse.ArgumentParser(description='Dump data on selected ethernet interface')
 
-   arg_parser.add_argument('-i', '--interface',    action='store',      help='Interface to listen on', required=True )
+   arg_parser.add_argument('-i', '--interface',    action='store',      help='Interface(s) to listen on', nargs='+')
    arg_parser.add_argument('-f', '--storage_file', action='store',      help= "Store captured packages in file")
    arg_parser.add_argument('-F', '--filter',       action='store',      help= 'Capture filter - a wireshark display filter')
+   arg_parser.add_argument('-b', '--bpf',          action='store',      help= 'Capture filter - a BPF (tcpdump) filter, applied in the kernel')
    arg_parser.add_argument('-c', '--counter',      action='store',      help= 'Number of total packages to capture', type=int, default=0)
    arg_parser.add_argument('-t', '--timeout',      action='store',      help= 'Capture timeout', type=int, default=0)
    arg_parser.add_argument('-V', '--verbose',      action='store_true', help= 'Run a bit more talkative', default=False)
    arg_parser.add_argument('-d', '--details',      action='store_true', help= 'Print the complete captured package, gives a lot of details (and output)')
+   arg_parser.add_argument('-r', '--read',         action='store',      help= 'Read packages from pcap/pcapng file(s) instead of an interface', nargs='+')
+   arg_parser.add_argument('-j', '--jobs',         action='store',      help= 'Processes counting the read files with --stats (without --details/--filter/--counter)', type=int, default=1)
+   arg_parser.add_argument('--ring_size',          action='store',      help= 'Start a new storage file every N MB', type=int, default=0)
+   arg_parser.add_argument('--ring_duration',      action='store',      help= 'Start a new storage file every N seconds', type=int, default=0)
+   arg_parser.add_argument('--ring_files',         action='store',      help= 'Keep only the last N storage files', type=int, default=0)
+   arg_parser.add_argument('-m', '--metrics',      action='store',      help= 'Report capture metrics to file (JSON lines, default stderr)', nargs='?', const='-')
+   arg_parser.add_argument('--metrics_format',     action='store',      help= 'Metrics as JSON lines or a Prometheus textfile', choices=['json', 'prometheus'], default='json')
+   arg_parser.add_argument('--metrics_interval',   action='store',      help= 'Seconds between the metrics reports', type=float, default=METRICS_INTERVAL)
+   arg_parser.add_argument('-s', '--stats',        action='store_true', help= 'Print the top flows and package rates instead of the packages')
+   arg_parser.add_argument('--top',                action='store',      help= 'Number of flows printed with --stats', type=int, default=STATS_TOP)
+   arg_parser.add_argument('--stats_interval',     action='store',      help= 'Seconds between the --stats prints', type=float, default=STATS_INTERVAL)
+   arg_parser.add_argument('--max_flows',          action='store',      help= 'Flows kept with --stats, the least recently seen are dropped', type=int, default=FLOW_TABLE_SIZE)
 
    args = arg_parser.parse_args()
 
+   if not args.interface and not args.read:
+      arg_parser.error('one of -i/--interface or -r/--read is required')
+   if args.read and args.storage_file:
+      arg_parser.error('-f/--storage_file can\'t be used with -r/--read')
+   if args.read and args.bpf:
+      arg_parser.error('-b/--bpf can\'t be used with -r/--read, use -F/--filter')
+   if args.metrics_format == 'prometheus' and args.metrics in (None, '-'):
+      arg_parser.error('--metrics_format prometheus needs a -m/--metrics file')
+   if (args.ring_size or args.ring_duration or args.ring_files) and not args.storage_file:
+      arg_parser.error('--ring_size/--ring_duration/--ring_files need -f/--storage_file')
+   if args.ring_files and not (args.ring_size or args.ring_duration):
+      arg_parser.error('--ring_files needs --ring_size or --ring_duration')
+   if args.jobs > 1 and not (args.read and args.stats):
+      arg_parser.error('-j/--jobs needs -r/--read and -s/--stats, printing the packages is fastest in one process')
+   if args.jobs > 1 and args.counter:
+      arg_parser.error('-j/--jobs can\'t be used with -c/--counter')
+
    interface_sniffer = InterfaceSniffer(args.interface,
                                         args.storage_file,
                                         args.filter,
                                         args.counter,
                                         args.timeout,
                                         args.verbose,
-                                        args.details)
+                                        args.details,
+                                        args.read,
+                                        args.jobs,
+                                        FlowStats(args.top, args.stats_interval, args.max_flows) if args.stats else None,
+                                        args.ring_size,
+                                        args.ring_duration,
+                                        args.ring_files,
+                                        args.bpf,
+                                        CaptureMetrics(args.metrics, args.metrics_format, args.metrics_interval) if args.metrics else None)
 
    ## Start sniffing based on input arguments
    interface_sniffer.start()
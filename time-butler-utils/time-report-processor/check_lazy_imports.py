@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Import regression check of the time report processor.
+
+Builds a small archive from a generated weekly CSV, then runs --version,
+--list-sheets and a cached --summary in fresh interpreters and fails if any
+of them imported pandas (or openpyxl), or if their total import time (as
+reported by python -X importtime, best of a few runs) exceeds
+IMPORT_BUDGET_MS. These modes are meant to start fast, without a CSV file and
+without the data libraries.
+
+Usage:
+   python3 check_lazy_imports.py
+"""
+
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+PROCESSOR = Path(__file__).resolve().with_name("time-report-processor.py")
+HEAVY_MODULES = ['pandas', 'openpyxl']
+# Total import time allowed for a lightweight mode, interpreter startup included
+IMPORT_BUDGET_MS = 100
+IMPORT_TIME_RUNS = 3
+# 'import time:      1064 |       5649 | zipfile', the first number is the module's own time in us
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|', re.MULTILINE)
+
+WEEKLY_CSV = """Week,Date,StartingTime,EndingTime,Hours,Description,Closed
+23,2025-06-02,08:00,12:00,4,code review,true
+23,2025-06-03,08:00,16:00,8,meeting and coding,true
+"""
+
+# Runs main() with the given arguments, prints the heavy modules that got imported
+RUN_CODE = """
+import importlib.util, io, sys
+from contextlib import redirect_stdout
+path, modules = sys.argv[1], sys.argv[2].split(',')
+spec = importlib.util.spec_from_file_location("time_report_processor", path)
+processor = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(processor)
+sys.argv = [path] + sys.argv[3:]
+try:
+   with redirect_stdout(io.StringIO()):
+      processor.main()
+except SystemExit as e:
+   if e.code:
+      raise
+print(' '.join(name for name in modules if name in sys.modules))
+"""
+
+
+def run_mode(*args):
+   """Modules out of HEAVY_MODULES imported by running the processor with args, and the total import time in ms."""
+   result = subprocess.run([sys.executable, "-X", "importtime", "-c", RUN_CODE, str(PROCESSOR), ','.join(HEAVY_MODULES)]
+                           + list(args), capture_output=True, text=True)
+   if result.returncode != 0:
+      raise RuntimeError(result.stderr.strip() or result.stdout.strip())
+   import_us = sum(int(us) for us in IMPORT_TIME_LINE.findall(result.stderr))
+   return result.stdout.split(), import_us / 1000
+
+
+def main():
+   failed = False
+   with tempfile.TemporaryDirectory() as tmp_dir:
+      csv_file = Path(tmp_dir) / "weekly.csv"
+      excel_file = Path(tmp_dir) / "archive.xlsx"
+      csv_file.write_text(WEEKLY_CSV, encoding='utf-8')
+      # Writing the archive also writes the summary cache
+      subprocess.run([sys.executable, str(PROCESSOR), str(csv_file), str(excel_file)],
+                     check=True, capture_output=True)
+
+      for mode in (['--version'], [str(excel_file), '--list-sheets'], [str(excel_file), '--summary']):
+         runs = [run_mode(*mode) for _ in range(IMPORT_TIME_RUNS)]
+         imported = runs[0][0]
+         import_ms = min(ms for _, ms in runs)
+         if imported:
+            print(f"FAIL: {mode[-1]} imported {', '.join(imported)}")
+            failed = True
+         elif import_ms > IMPORT_BUDGET_MS:
+            print(f"FAIL: {mode[-1]} took {import_ms:.1f} ms of imports, over the {IMPORT_BUDGET_MS} ms budget")
+            failed = True
+         else:
+            print(f"{mode[-1]}: no data libraries imported, {import_ms:.1f} ms of imports")
+   if failed:
+      sys.exit(1)
+   print("OK")
+
+
+if __name__ == "__main__":
+   main()
@@ -6,20 +6,25 @@ Appends weekly, monthly, or project time reports from CSV files to a main Excel
 
 Usage:
    python time_report_processor.py <csv_file_path> [excel_file_path]
+   python time_report_processor.py [excel_file_path] --summary|--list-sheets
+   python time_report_processor.py query [excel_file_path] --by week|month|project|keyword|sheet
 
 Example:
    python time_report_processor.py weekly_report.csv
    python time_report_processor.py monthly_report.csv main_reports.xlsx
    python time_report_processor.py SPA2-Generic_report.csv project_reports.xlsx
+   python time_report_processor.py query --by week --from 2025-01-01 --to 2025-06-30
 """
 
-import pandas as pd
 import argparse
 import sys
 from pathlib import Path
 from datetime import datetime
 import logging
 import re
+import json
+import zipfile
+import xml.etree.ElementTree as ET
 
 # Configure logging
 logging.basicConfig(
@@ -30,6 +35,18 @@ logging.basicConfig(
    ]
 )
 
+# pandas (and openpyxl through it) is only imported when report data is actually
+# touched, so --version, --help, --list-sheets and cached summaries start fast.
+pd = None
+
+def load_pandas():
+   """Import pandas on first use and bind it to the module level 'pd' name."""
+   global pd
+   if pd is None:
+      import pandas
+      pd = pandas
+   return pd
+
 class TimeReportProcessor:
    """Handles processing and appending time reports to Excel files."""
    EXPECTED_COLUMNS = {
@@ -45,9 +62,10 @@ class TimeReportProcessor:
    }
 
    def __init__(self, csv_file_path, excel_file_path=None):
-      self.csv_file_path = Path(csv_file_path)
+      # No CSV is needed for the Excel-only modes (--summary, --list-sheets)
+      self.csv_file_path = Path(csv_file_path) if csv_file_path else None
       self.excel_file_path = Path(excel_file_path or 'time_reports.xlsx')
-      if not self.csv_file_path.exists():
+      if self.csv_file_path and not self.csv_file_path.exists():
          raise FileNotFoundError(f"CSV file not found: {self.csv_file_path}")
 
    def extract_project_name(self, filename):
@@ -176,6 +194,7 @@ class TimeReportProcessor:
       return df_processed
 
    def load_csv(self):
+      load_pandas()
       try:
          encodings = ['utf-8', 'utf-8-sig', 'latin-1', 'cp1252']
          df = None
@@ -347,6 +366,7 @@ class TimeReportProcessor:
       return excel_data
 
    def load_or_create_excel(self, project_name=None):
+      load_pandas()
       excel_data = {}
       # Don't pre-create 'weekly' or 'monthly' sheets, as they are now year-based
       standard_sheets = {}
@@ -509,26 +529,90 @@ class TimeReportProcessor:
       except Exception as e:
          logging.error(f"Error saving Excel file: {e}")
          raise
+      self.write_summary_cache(excel_data)
+
+   def sheet_report_type(self, sheet_name):
+      if sheet_name.startswith('weekly_'):
+         return 'weekly'
+      if sheet_name.startswith('monthly_'):
+         return 'monthly'
+      if sheet_name in ['weekly', 'monthly']:
+         return sheet_name
+      return 'project'
+
+   def sheet_summaries(self, excel_data):
+      """Records and total hours per non-empty sheet, as used by the summary output."""
+      summaries = {}
+      for sheet_name, df in excel_data.items():
+         if not df.empty:
+            sheet_summary = self.generate_summary(df, self.sheet_report_type(sheet_name))
+            summaries[sheet_name] = {
+               'records': len(df),
+               'total_hours': float(sheet_summary.get('total_hours', 0) or 0)
+            }
+      return summaries
+
+   def summary_cache_path(self):
+      return self.excel_file_path.with_name(self.excel_file_path.name + '.summary.json')
+
+   def write_summary_cache(self, excel_data):
+      """Store sheet summaries next to the Excel file, so --summary can skip loading it."""
+      if not self.excel_file_path.exists():
+         return
+      stat = self.excel_file_path.stat()
+      cache = {
+         'excel_mtime_ns': stat.st_mtime_ns,
+         'excel_size': stat.st_size,
+         'sheets': self.sheet_summaries(excel_data)
+      }
+      try:
+         with open(self.summary_cache_path(), 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2)
+      except OSError as e:
+         logging.warning(f"Could not write summary cache: {e}")
+
+   def read_summary_cache(self):
+      """Return cached sheet summaries, or None if missing or older than the Excel file."""
+      cache_path = self.summary_cache_path()
+      if not cache_path.exists() or not self.excel_file_path.exists():
+         return None
+      try:
+         with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+      except (OSError, ValueError) as e:
+         logging.warning(f"Ignoring unreadable summary cache: {e}")
+         return None
+      stat = self.excel_file_path.stat()
+      if cache.get('excel_mtime_ns') != stat.st_mtime_ns or cache.get('excel_size') != stat.st_size:
+         return None
+      return cache.get('sheets')
 
    def print_excel_summary(self):
-      excel_data = self.load_or_create_excel()
+      summaries = self.read_summary_cache()
+      if summaries is None:
+         excel_data = self.load_or_create_excel()
+         summaries = self.sheet_summaries(excel_data)
+         self.write_summary_cache(excel_data)
+      else:
+         logging.info(f"Using cached summary: {self.summary_cache_path()}")
       print(f"\n📋 All Sheets:")
-      for sheet_name, df in excel_data.items():
-         if not df.empty:
-            # Determine report_type for summary
-            if sheet_name.startswith('weekly_'):
-               summary_type = 'weekly'
-            elif sheet_name.startswith('monthly_'):
-               summary_type = 'monthly'
-            elif sheet_name in ['weekly', 'monthly']:
-               summary_type = sheet_name
-            else:
-               summary_type = 'project'
-            sheet_summary = self.generate_summary(df, summary_type)
-            hours = sheet_summary.get('total_hours', 0)
-            print(f"   • {sheet_name}: {len(df)} records" + (f", {hours:.2f} hours" if hours > 0 else ""))
+      for sheet_name, sheet_summary in summaries.items():
+         hours = sheet_summary['total_hours']
+         print(f"   • {sheet_name}: {sheet_summary['records']} records" + (f", {hours:.2f} hours" if hours > 0 else ""))
       print(f"   • Output file: {self.excel_file_path}")
 
+   def list_sheets(self):
+      """Print the sheet names, read straight from the workbook xml without loading any data."""
+      if not self.excel_file_path.exists():
+         print(f"❌ Excel file not found: {self.excel_file_path}")
+         return
+      ns = {'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+      with zipfile.ZipFile(self.excel_file_path) as xlsx:
+         workbook = ET.fromstring(xlsx.read('xl/workbook.xml'))
+      print(f"\n📋 Sheets in {self.excel_file_path}:")
+      for sheet in workbook.iterfind('main:sheets/main:sheet', ns):
+         print(f"   • {sheet.get('name')}")
+
    def process(self):
       try:
          logging.info(f"Starting processing of {self.csv_file_path}")
@@ -599,7 +683,194 @@ class TimeReportProcessor:
          sys.exit(1)
 
 
+class TimeReportQuery:
+   """Runs group-by aggregations over all sheets of an archive Excel file."""
+   GROUP_BY = ['week', 'month', 'project', 'keyword', 'sheet']
+   # Key columns identifying the same time entry in weekly and monthly sheets
+   ENTRY_KEY_COLUMNS = ['Date', 'StartingTime', 'EndingTime', 'Hours', 'Description']
+   # Group of weekly/monthly entries with --by project, they have no project of their own
+   NO_PROJECT = '(weekly/monthly)'
+   # Bumped when the cached frame layout changes
+   FRAME_CACHE_VERSION = 2
+
+   def __init__(self, excel_file_path):
+      self.excel_file_path = Path(excel_file_path)
+      if not self.excel_file_path.exists():
+         raise FileNotFoundError(f"Excel file not found: {self.excel_file_path}")
+
+   def frame_cache_path(self):
+      return self.excel_file_path.with_name(self.excel_file_path.name + '.query.pkl')
+
+   def sheet_to_frame(self, sheet_name, df):
+      """Normalize one sheet into the common Date/Hours/Description/Project/Sheet layout."""
+      if sheet_name.startswith(('weekly', 'monthly')):
+         frame = pd.DataFrame({
+            'Date': pd.to_datetime(df['Date'], errors='coerce') if 'Date' in df.columns else pd.NaT,
+            'Hours': pd.to_numeric(df['Hours'], errors='coerce') if 'Hours' in df.columns else 0.0,
+            'Description': df['Description'] if 'Description' in df.columns else '',
+            'Project': None
+         }, index=df.index)
+         for col in ['StartingTime', 'EndingTime']:
+            frame[col] = df[col].astype(str) if col in df.columns else ''
+      else:
+         frame = pd.DataFrame({
+            'Date': pd.to_datetime(df['created'], errors='coerce') if 'created' in df.columns else pd.NaT,
+            'Hours': pd.to_numeric(df['hours'], errors='coerce') if 'hours' in df.columns else 0.0,
+            'Description': df['description'] if 'description' in df.columns else '',
+            'Project': sheet_name
+         }, index=df.index)
+      frame['Sheet'] = sheet_name
+      return frame
+
+   def build_frame(self):
+      with pd.ExcelFile(self.excel_file_path) as xl:
+         frames = [self.sheet_to_frame(sheet_name, pd.read_excel(xl, sheet_name=sheet_name))
+                   for sheet_name in xl.sheet_names]
+      frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+         columns=['Date', 'Hours', 'Description', 'Project', 'Sheet', 'StartingTime', 'EndingTime'])
+      frame['Description'] = frame['Description'].fillna('').astype(str)
+      frame['Hours'] = frame['Hours'].fillna(0.0)
+      return frame
+
+   def drop_overlap(self, frame):
+      """Drop monthly entries that are also reported in a weekly sheet, so each is counted once.
+
+      Entries are paired one to one on ENTRY_KEY_COLUMNS, repeated entries within
+      one report kind (e.g. two without times on the same day) are all kept."""
+      is_weekly = frame['Sheet'].str.startswith('weekly')
+      is_monthly = frame['Sheet'].str.startswith('monthly')
+      if not is_weekly.any() or not is_monthly.any():
+         return frame
+      # Number the repeats of a key, so n weekly copies cancel at most n monthly ones
+      weekly = frame.loc[is_weekly, self.ENTRY_KEY_COLUMNS]
+      weekly['Repeat'] = weekly.groupby(self.ENTRY_KEY_COLUMNS, dropna=False).cumcount()
+      monthly = frame.loc[is_monthly, self.ENTRY_KEY_COLUMNS]
+      monthly['Repeat'] = monthly.groupby(self.ENTRY_KEY_COLUMNS, dropna=False).cumcount()
+      overlap = monthly.reset_index().merge(weekly, how='inner', on=list(weekly.columns))
+      return frame.drop(index=overlap['index'])
+
+   def load_frame(self):
+      """Return the archive as one columnar frame, cached until the Excel file changes."""
+      load_pandas()
+      stat = self.excel_file_path.stat()
+      cache_path = self.frame_cache_path()
+      if cache_path.exists():
+         try:
+            cache = pd.read_pickle(cache_path)
+            if (cache.get('version') == self.FRAME_CACHE_VERSION and
+                  cache['excel_mtime_ns'] == stat.st_mtime_ns and cache['excel_size'] == stat.st_size):
+               logging.info(f"Using cached query data: {cache_path}")
+               return cache['frame']
+         except Exception as e:
+            logging.warning(f"Ignoring unreadable query cache: {e}")
+      frame = self.build_frame()
+      try:
+         pd.to_pickle({'version': self.FRAME_CACHE_VERSION, 'excel_mtime_ns': stat.st_mtime_ns,
+                       'excel_size': stat.st_size, 'frame': frame}, cache_path)
+      except OSError as e:
+         logging.warning(f"Could not write query cache: {e}")
+      return frame
+
+   def run(self, group_by, date_from=None, date_to=None, keywords=None):
+      """Sum hours per group, returns a frame with Group, Entries and Hours columns."""
+      if group_by not in self.GROUP_BY:
+         raise ValueError(f"Unsupported grouping '{group_by}', expected one of: {self.GROUP_BY}")
+      if group_by == 'keyword' and not keywords:
+         raise ValueError("Grouping by keyword requires at least one --keyword")
+      frame = self.load_frame()
+      if date_from:
+         frame = frame[frame['Date'] >= pd.Timestamp(date_from)]
+      if date_to:
+         # Inclusive, the whole 'to' day is part of the range
+         frame = frame[frame['Date'] < pd.Timestamp(date_to) + pd.Timedelta(days=1)]
+      # Per sheet every row counts, across sheets a weekly and a monthly copy is one entry
+      if group_by != 'sheet':
+         frame = self.drop_overlap(frame)
+
+      if group_by == 'keyword':
+         rows = []
+         for keyword in keywords:
+            hits = frame.loc[frame['Description'].str.contains(keyword, case=False, regex=False), 'Hours']
+            rows.append({'Group': keyword, 'Entries': len(hits), 'Hours': hits.sum()})
+         return pd.DataFrame(rows, columns=['Group', 'Entries', 'Hours'])
+
+      if group_by == 'week':
+         iso = frame['Date'].dt.isocalendar()
+         keys = iso['year'].astype(str) + '-W' + iso['week'].astype(str).str.zfill(2)
+      elif group_by == 'month':
+         keys = frame['Date'].dt.strftime('%Y-%m')
+      elif group_by == 'project':
+         keys = frame['Project'].fillna(self.NO_PROJECT)
+      else:
+         keys = frame['Sheet']
+      result = frame.groupby(keys.rename('Group'))['Hours'].agg(['count', 'sum']).reset_index()
+      return result.rename(columns={'count': 'Entries', 'sum': 'Hours'}).sort_values('Group')
+
+   def print_result(self, result, group_by):
+      print(f"\n📊 Hours per {group_by}:")
+      if result.empty:
+         print("   • No matching entries")
+         return
+      width = max(len(str(group)) for group in result['Group'])
+      for row in result.itertuples(index=False):
+         print(f"   • {str(row.Group):<{width}}  {row.Entries:>5} entries  {row.Hours:>8.2f} hours")
+      # Keywords can match the same entry, a total would count it several times
+      if group_by != 'keyword':
+         print(f"   • Total: {result['Hours'].sum():.2f} hours")
+
+
+def query_main(argv):
+   parser = argparse.ArgumentParser(
+      prog='time_report_processor.py query',
+      description='Aggregate hours over all sheets of an archive Excel file',
+      formatter_class=argparse.RawDescriptionHelpFormatter,
+      epilog='''
+Examples:
+  python time_report_processor.py query --by month
+  python time_report_processor.py query reports.xlsx --by week --from 2025-01-01 --to 2025-03-31
+  python time_report_processor.py query --by keyword --keyword review --keyword meeting
+      '''
+   )
+   parser.add_argument(
+      'excel_file',
+      nargs='?',
+      default='time_reports_archive.xlsx',
+      help='Path to the Excel file to query (default: time_reports_archive.xlsx)'
+   )
+   parser.add_argument(
+      '--by',
+      choices=TimeReportQuery.GROUP_BY,
+      default='month',
+      help='Group hours by (default: month)'
+   )
+   parser.add_argument('--from', dest='date_from', help='First date to include (YYYY-MM-DD)')
+   parser.add_argument('--to', dest='date_to', help='Last date to include (YYYY-MM-DD)')
+   parser.add_argument(
+      '--keyword',
+      action='append',
+      default=[],
+      help='Description keyword (case-insensitive), used with --by keyword. Can be given multiple times'
+   )
+   args = parser.parse_args(argv)
+
+   try:
+      query = TimeReportQuery(args.excel_file)
+      load_pandas()
+      start = datetime.now()
+      result = query.run(args.by, args.date_from, args.date_to, args.keyword)
+      logging.info(f"Query finished in {(datetime.now() - start).total_seconds() * 1000:.1f} ms")
+      query.print_result(result, args.by)
+   except Exception as e:
+      logging.error(f"Query failed: {e}")
+      print(f"\n❌ Error: {e}")
+      sys.exit(1)
+
+
 def main():
+   if len(sys.argv) > 1 and sys.argv[1] == 'query':
+      query_main(sys.argv[2:])
+      return
+
    parser = argparse.ArgumentParser(
       description='Append time reports from CSV files to a main Excel file',
       formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -609,17 +880,20 @@ Examples:
   python time_report_processor.py month5_report.csv main_reports.xlsx
   python time_report_processor.py SPA2-Generic_report.csv project_reports.xlsx
   python time_report_processor.py data/report.csv output/reports.xlsx
+  python time_report_processor.py query --by month output/reports.xlsx
+
+Run 'python time_report_processor.py query --help' for the query options.
       '''
    )
    parser.add_argument(
       'csv_file',
-      help='Path to the CSV file containing time report data'
+      nargs='?',
+      help='Path to the CSV file containing time report data (not needed with --summary/--list-sheets)'
    )
    parser.add_argument(
       'excel_file',
       nargs='?',
-      default='time_reports_archive.xlsx',
-      help='Path to the Excel file to append data to (default: time_reports.xlsx)'
+      help='Path to the Excel file to append data to (default: time_reports_archive.xlsx)'
    )
    parser.add_argument(
       '--version',
@@ -632,13 +906,34 @@ Examples:
    default=False,
    help='Print a summary of the provided Excel file and exit'
 )
+   parser.add_argument(
+      '--list-sheets',
+      action='store_true',
+      default=False,
+      help='List the sheet names of the provided Excel file and exit'
+   )
    args = parser.parse_args()
-   processor = TimeReportProcessor(args.csv_file, args.excel_file)
-
-   if args.summary:
-      processor.print_excel_summary()
-   else:
-      processor.process()
+   excel_file = args.excel_file or 'time_reports_archive.xlsx'
+
+   # The Excel-only modes never read the CSV, a single .xlsx argument is the Excel file
+   if args.list_sheets or args.summary:
+      if args.excel_file is None and args.csv_file and Path(args.csv_file).suffix.lower() == '.xlsx':
+         excel_file = args.csv_file
+      processor = TimeReportProcessor(None, excel_file)
+      if args.list_sheets:
+         processor.list_sheets()
+      else:
+         processor.print_excel_summary()
+      return
+
+   if not args.csv_file:
+      parser.error('the csv_file argument is required')
+   try:
+      processor = TimeReportProcessor(args.csv_file, excel_file)
+   except FileNotFoundError as e:
+      print(f"\n❌ Error: {e}")
+      sys.exit(1)
+   processor.process()
 
 if __name__ == '__main__':
    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Memory regression check of the yj-tree streaming loader.
+
+Generates a large JSON array of flat records, then loads it in separate
+processes with json.load and with the streaming loader, and compares their
+peak RSS. Fails when streaming uses more than MAX_RSS_RATIO of what json.load
+needs, streaming is the default for files above STREAMING_THRESHOLD and must
+never be the worse choice. The streaming and compact loads are measured again
+with the search index built, which must stay below MAX_INDEX_RSS_RATIO of
+json.load.
+
+Usage:
+    python3 check_streaming_memory.py [--records N] [--keep FILE]
+
+Author: dherslof
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# Streaming peak RSS allowed, relative to the json.load peak
+MAX_RSS_RATIO = 0.5
+# Peak RSS of a streaming/compact load with the search index, relative to the json.load peak
+MAX_INDEX_RSS_RATIO = 1.0
+DEFAULT_RECORDS = 600000
+
+YJ_TREE = Path(__file__).resolve().with_name("yj-tree.py")
+
+# Run in a fresh interpreter each, prints "<peak RSS in KB> <seconds>"
+BASELINE_CODE = """
+import json, resource, sys, time
+start = time.time()
+with open(sys.argv[1], 'rb') as f:
+    data = json.load(f)
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, time.time() - start)
+"""
+# Also takes the load mode (stream or compact) and whether to build the index
+STREAMING_CODE = """
+import importlib.util, io, resource, sys, time
+from contextlib import redirect_stdout
+spec = importlib.util.spec_from_file_location("yj_tree", sys.argv[2])
+yj_tree = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(yj_tree)
+start = time.time()
+visualizer = yj_tree.TreeVisualizer()
+with redirect_stdout(io.StringIO()):
+    loaded = visualizer.load_file(sys.argv[1], stream=True, compact=sys.argv[3] == "compact")
+if not loaded or visualizer.loader is None:
+    sys.exit("streaming load failed")
+if sys.argv[4] == "index":
+    visualizer.build_index()
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, time.time() - start)
+"""
+
+
+def generate(file_path: str, records: int):
+    """Write an array of flat records, about 100 bytes each."""
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write("[")
+        for i in range(records):
+            if i:
+                f.write(",")
+            f.write(json.dumps({"id": i, "name": f"user{i}", "email": f"u{i}@example.com",
+                                "score": i * 0.5, "active": i % 3 != 0}))
+        f.write("]")
+
+
+def measure(code: str, file_path: str, *args: str):
+    """Peak RSS (KB) and load time of code run on file_path in its own process."""
+    result = subprocess.run([sys.executable, "-c", code, file_path, str(YJ_TREE)] + list(args),
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or result.stdout.strip())
+    rss, seconds = result.stdout.split()
+    return int(rss), float(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare streaming and json.load memory use on a large array")
+    parser.add_argument("--records", type=int, default=DEFAULT_RECORDS,
+                        help=f"Records in the generated array (default: {DEFAULT_RECORDS})")
+    parser.add_argument("--keep", metavar="FILE", help="Generate into FILE and keep it")
+    args = parser.parse_args()
+
+    file_path = args.keep or tempfile.mkstemp(suffix=".json")[1]
+    try:
+        generate(file_path, args.records)
+        size = os.path.getsize(file_path) / (1024 * 1024)
+        baseline_rss, baseline_time = measure(BASELINE_CODE, file_path)
+        streaming_rss, streaming_time = measure(STREAMING_CODE, file_path, "stream", "")
+        indexed = [(mode,) + measure(STREAMING_CODE, file_path, mode, "index") for mode in ("stream", "compact")]
+    finally:
+        if not args.keep:
+            os.unlink(file_path)
+
+    print(f"{args.records} records, {size:.1f} MB")
+    print(f"{'json.load:':<16} {baseline_rss // 1024:>6} MB peak RSS, {baseline_time:.1f} s")
+    print(f"{'streaming:':<16} {streaming_rss // 1024:>6} MB peak RSS, {streaming_time:.1f} s")
+    for mode, rss, seconds in indexed:
+        print(f"{mode + ' + index:':<16} {rss // 1024:>6} MB peak RSS, {seconds:.1f} s")
+    failed = False
+    if streaming_rss > baseline_rss * MAX_RSS_RATIO:
+        print(f"FAIL: streaming peak RSS is above {MAX_RSS_RATIO:.0%} of json.load")
+        failed = True
+    for mode, rss, _ in indexed:
+        if rss > baseline_rss * MAX_INDEX_RSS_RATIO:
+            print(f"FAIL: {mode} + index peak RSS is above {MAX_INDEX_RSS_RATIO:.0%} of json.load")
+            failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
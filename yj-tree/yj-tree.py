@@ -6,7 +6,8 @@ A simple program to visualize YAML/JSON files as interactive tree structures.
 Supports both text-based and GUI visualization modes.
 
 Usage:
-    python visualizer.py <file_path> [--mode gui|text] [--expand-all]
+    python visualizer.py <file_path> [--mode gui|text] [--expand-all] [--diff OTHER_FILE] [--stream] [--compact]
+    python visualizer.py query <path> <file_path> [--paths] [--raw] [-o FILE]
 
 Dependencies:
     pip install pyyaml tkinter (tkinter usually comes with Python)
@@ -17,12 +18,1288 @@ Author: dherslof
 import json
 import yaml
 import argparse
+import bisect
+import difflib
+import hashlib
+import heapq
+import itertools
+import mmap
+import os
+import queue
+import re
+import shlex
+import subprocess
 import sys
+import threading
+from contextlib import contextmanager, redirect_stdout
+from array import array
+from collections.abc import Mapping, Sequence
 from pathlib import Path
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, TextIO, Tuple, Union
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 
+try:
+    # Optional, several times faster JSON parsing
+    import orjson
+except ImportError:
+    orjson = None
+
+# The libyaml based loader is a lot faster, available when pyyaml is built with libyaml
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+JSON_EXTENSIONS = (".json",)
+JSON_LINES_EXTENSIONS = (".jsonl", ".ndjson")
+YAML_EXTENSIONS = (".yml", ".yaml")
+# Parsers tried for a detected format, in order
+PARSE_ORDER = {
+    "json": ("json", "jsonl", "yaml"),
+    "jsonl": ("jsonl",),
+    "yaml": ("yaml", "json"),
+}
+FORMAT_NAMES = {"json": "JSON", "jsonl": "JSON Lines", "yaml": "YAML"}
+
+# JSON files of at least this size are loaded with the streaming loader
+STREAMING_THRESHOLD = 32 * 1024 * 1024
+
+# Max children the GUI inserts under one node, larger containers are split in index ranges
+PAGE_SIZE = 1000
+# Type tags of the nodes in a NodeStore, containers first
+NODE_OBJECT, NODE_ARRAY, NODE_STRING, NODE_NUMBER, NODE_TRUE, NODE_FALSE, NODE_NULL = range(7)
+_SCALAR_TAGS = {b"t": NODE_TRUE, b"f": NODE_FALSE, b"n": NODE_NULL}
+_SCALAR_VALUES = {NODE_TRUE: True, NODE_FALSE: False, NODE_NULL: None}
+PLACEHOLDER_TEXT = "..."
+# Loading progress is reported (and cancellation checked) every PROGRESS_STEP bytes
+PROGRESS_STEP = 4 * 1024 * 1024
+# How often the GUI polls the background loader for progress
+LOAD_POLL_MS = 100
+# Text mode output is written in batches of lines, through a buffer of OUTPUT_BUFFER_SIZE bytes
+OUTPUT_BATCH = 4096
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+# Max number of results returned by a search
+SEARCH_LIMIT = 1000
+# Number of subtrees listed as heaviest, in text mode and the GUI
+HEAVIEST_LIMIT = 20
+HEAVIEST_GUI_LIMIT = 100
+# Keys (paths) identifying the objects in a list, tried in order when diffing lists
+DIFF_MATCH_KEYS = (("id",), ("name",), ("key",), ("uid",), ("metadata", "name"))
+# Terminal colours of diff lines
+DIFF_COLORS = {"added": "\033[32m", "removed": "\033[31m", "changed": "\033[33m", "modified": "\033[33m"}
+DIFF_MARKERS = {"added": "+", "removed": "-", "changed": "~", "modified": "~"}
+# Colours of diff nodes in the GUI
+DIFF_GUI_COLORS = {"added": "#2e7d32", "removed": "#c62828", "changed": "#b26a00", "modified": "#b26a00",
+                   "same": "#808080"}
+
+# One JSON token: string, punctuation or scalar (number/true/false/null)
+_JSON_TOKEN = re.compile(
+    rb'[ \t\r\n]*(?:("[^"\\]*(?:\\.[^"\\]*)*")|([\[\]{}:,])|(-?[0-9][-+.0-9eE]*|true|false|null))',
+    re.DOTALL)
+_JSON_WHITESPACE = re.compile(rb'[ \t\r\n]*')
+# A string (group 1) or whitespace outside of strings, .sub(rb"\1") strips the whitespace
+_JSON_INSIGNIFICANT = re.compile(rb'("[^"\\]*(?:\\.[^"\\]*)*")|[ \t\r\n]+', re.DOTALL)
+# Everything up to the next bracket outside of a string, strings are consumed by the regex engine
+_JSON_SKIP = re.compile(
+    rb'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*(?:([\[{])|[\]}])',
+    re.DOTALL)
+
+
+def detect_format(file_path: Path) -> str:
+    """Format of a file from its extension, or else its first bytes: 'json', 'jsonl' or 'yaml'."""
+    suffix = file_path.suffix.lower()
+    if suffix in JSON_EXTENSIONS:
+        return "json"
+    if suffix in JSON_LINES_EXTENSIONS:
+        return "jsonl"
+    if suffix in YAML_EXTENSIONS:
+        return "yaml"
+
+    with open(file_path, 'rb') as f:
+        head = f.read(4096).lstrip()
+    return "json" if head.startswith((b"{", b"[")) else "yaml"
+
+
+def parse_json(content: bytes) -> Any:
+    if orjson:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # Also valid for json, e.g. NaN or integers beyond 64 bits
+            pass
+    return json.loads(content)
+
+
+def decode_token(raw: bytes) -> Any:
+    """Value of a JSON string or scalar token, common cases are decoded without json.loads()."""
+    first = raw[:1]
+    if first == b'"':
+        return json.loads(raw) if b"\\" in raw else raw[1:-1].decode('utf-8')
+    if first == b"t":
+        return True
+    if first == b"f":
+        return False
+    if first == b"n":
+        return None
+    return float(raw) if b"." in raw or b"e" in raw or b"E" in raw else int(raw)
+
+
+def parse_content(content: bytes, file_format: str) -> Tuple[Any, str]:
+    """Parse file content, returns the data and a description of what it was parsed as.
+
+    JSON Lines and multi-document YAML give a list with one item per document.
+    """
+    if file_format == "json":
+        return parse_json(content), "JSON (orjson)" if orjson else "JSON"
+
+    if file_format == "jsonl":
+        documents = [parse_json(line) for line in content.splitlines() if line.strip()]
+        return documents, f"JSON Lines ({len(documents)} documents)"
+
+    documents = list(yaml.load_all(content.decode('utf-8'), Loader=YAML_LOADER))
+    description = "YAML (libyaml)" if YAML_LOADER is not yaml.SafeLoader else "YAML"
+    if len(documents) == 1:
+        return documents[0], description
+    return documents, f"{description} ({len(documents)} documents)"
+
+
+class LoadCancelled(Exception):
+    """Raised inside a load when its cancel event has been set."""
+
+
+def _check_cancelled(cancel: Union[threading.Event, None]):
+    if cancel is not None and cancel.is_set():
+        raise LoadCancelled()
+
+
+class LazyNode:
+    """A JSON container not parsed yet, only its byte span in the source file is known."""
+
+    __slots__ = ("loader", "start", "end")
+
+    def __init__(self, loader: "StreamingJSONLoader", start: int, end: int):
+        self.loader = loader
+        self.start = start
+        self.end = end
+
+    @property
+    def is_object(self) -> bool:
+        return self.loader.mm[self.start:self.start + 1] == b"{"
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+    def load(self) -> Union["PagedObject", "PagedArray"]:
+        """Scan the container for the offsets of its children, they are parsed when accessed."""
+        return self.loader.container(self.start)
+
+
+class PagedArray(Sequence):
+    """A JSON array of a streaming load, only the byte spans of its items are kept.
+
+    Items are parsed on access: scalars are decoded and containers are LazyNodes,
+    so an array of a million records costs 16 bytes per record until viewed.
+    """
+
+    __slots__ = ("loader", "start", "end", "starts", "ends")
+
+    def __init__(self, loader: "StreamingJSONLoader", start: int, end: int, starts: array, ends: array):
+        self.loader = loader
+        self.start = start
+        self.end = end
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, index: int) -> Any:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.loader.item(self.starts[index], self.ends[index])
+
+    def __iter__(self):
+        item = self.loader.item
+        for start, end in zip(self.starts, self.ends):
+            yield item(start, end)
+
+
+class PagedObject(Mapping):
+    """A JSON object of a streaming load, only the byte offsets of its keys and values are kept.
+
+    Values are parsed on access like the items of a PagedArray. Lookups by key
+    build a key to position map on first use, positional access (key_at(),
+    value_at()) doesn't need it.
+    """
+
+    __slots__ = ("loader", "start", "end", "key_starts", "starts", "ends", "_positions")
+
+    def __init__(self, loader: "StreamingJSONLoader", start: int, end: int, key_starts: array,
+                 starts: array, ends: array):
+        self.loader = loader
+        self.start = start
+        self.end = end
+        self.key_starts = key_starts
+        self.starts = starts
+        self.ends = ends
+        self._positions: Union[Dict[str, int], None] = None
+
+    def __len__(self) -> int:
+        return len(self.key_starts)
+
+    def __getitem__(self, key: str) -> Any:
+        if self._positions is None:
+            self._positions = {k: i for i, k in enumerate(self)}
+        return self.value_at(self._positions[key])
+
+    def __iter__(self):
+        string = self.loader.string
+        for start in self.key_starts:
+            yield string(start)
+
+    def key_at(self, index: int) -> str:
+        return self.loader.string(self.key_starts[index])
+
+    def value_at(self, index: int) -> Any:
+        return self.loader.item(self.starts[index], self.ends[index])
+
+    def items(self):
+        """(key, value) pairs in document order, without building the key map."""
+        string = self.loader.string
+        item = self.loader.item
+        for key_start, start, end in zip(self.key_starts, self.starts, self.ends):
+            yield string(key_start), item(start, end)
+
+    def values(self):
+        item = self.loader.item
+        for start, end in zip(self.starts, self.ends):
+            yield item(start, end)
+
+
+# Containers as parsed by a normal load or the streaming loader
+OBJECT_TYPES = (dict, PagedObject)
+ARRAY_TYPES = (list, PagedArray)
+CONTAINER_TYPES = OBJECT_TYPES + ARRAY_TYPES
+
+
+class StreamingJSONLoader:
+    """Scans a memory mapped JSON file, never building more than one container level at a time.
+
+    A loaded container is a PagedObject/PagedArray that keeps the byte spans of
+    its children, containers among them are LazyNodes until they are opened.
+    Memory use is bounded by the widest container viewed, not by the file size.
+    """
+
+    def __init__(self, file_path: Path, mm: Union[mmap.mmap, None] = None):
+        """Map file_path, or scan the mapping mm of another loader of the same file (left open by close())."""
+        self.progress = None
+        self.cancel = None
+        self._next_report = 0
+        if mm is not None:
+            self._file = None
+            self.mm = mm
+            return
+        self._file = open(file_path, 'rb')
+        try:
+            self.mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise
+
+    def close(self):
+        if self._file:
+            self.mm.close()
+            self._file.close()
+
+    def load(self, progress=None, cancel: Union[threading.Event, None] = None) -> Any:
+        """Scan the document, progress(bytes_done, bytes_total) is called every PROGRESS_STEP bytes."""
+        self.progress = progress
+        self.cancel = cancel
+        self._next_report = 0
+        try:
+            value = self.container(_JSON_WHITESPACE.match(self.mm, 0).end())
+        finally:
+            # Lazy nodes parsed later on are not part of this load
+            self.progress = None
+            self.cancel = None
+        if _JSON_WHITESPACE.match(self.mm, value.end).end() != len(self.mm):
+            raise ValueError(f"Extra data at byte {value.end}")
+        return value
+
+    def _checkpoint(self, pos: int):
+        self._next_report = pos + PROGRESS_STEP
+        _check_cancelled(self.cancel)
+        if self.progress:
+            self.progress(pos, len(self.mm))
+
+    def _token(self, pos: int) -> "re.Match":
+        match = _JSON_TOKEN.match(self.mm, pos)
+        if match is None:
+            raise ValueError(f"Invalid JSON at byte {pos}")
+        return match
+
+    def string(self, pos: int) -> str:
+        """Decode the string token at pos."""
+        return decode_token(self._token(pos).group(1))
+
+    def item(self, start: int, end: int) -> Any:
+        """Value of the child spanning start..end of a paged container."""
+        first = self.mm[start:start + 1]
+        if first == b"{" or first == b"[":
+            if self._token(start + 1).group(2) in (b"}", b"]"):
+                return {} if first == b"{" else []
+            return LazyNode(self, start, end)
+        return decode_token(self.mm[start:end])
+
+    def container(self, start: int) -> Union[PagedObject, PagedArray]:
+        """Scan the container opening at start, recording the byte spans of its children."""
+        # Hot loop, look up everything once
+        token = self._token
+        skip = self.skip
+        is_object = self.mm[start:start + 1] == b"{"
+        if not is_object and self.mm[start:start + 1] != b"[":
+            raise ValueError(f"Expected object or array at byte {start}")
+        closer = b"}" if is_object else b"]"
+        key_starts, starts, ends = array('q'), array('q'), array('q')
+
+        match = token(start + 1)
+        if match.group(2) != closer:
+            while True:
+                if is_object:
+                    if match.lastindex != 1:
+                        raise ValueError(f"Expected object key at byte {match.start()}")
+                    key_starts.append(match.start(1))
+                    colon = token(match.end())
+                    if colon.group(2) != b":":
+                        raise ValueError(f"Expected ':' at byte {colon.start()}")
+                    match = token(colon.end())
+                kind = match.lastindex
+                if kind == 2:
+                    punct = match.group(2)
+                    if punct != b"{" and punct != b"[":
+                        raise ValueError(f"Unexpected '{punct.decode()}' at byte {match.start(2)}")
+                    value_start = match.start(2)
+                    pos = skip(value_start)
+                else:
+                    value_start = match.start(kind)
+                    pos = match.end()
+                starts.append(value_start)
+                ends.append(pos)
+                if pos >= self._next_report:
+                    self._checkpoint(pos)
+
+                match = token(pos)
+                punct = match.group(2)
+                if punct == closer:
+                    break
+                if punct != b",":
+                    raise ValueError(f"Expected ',' or '{closer.decode()}' at byte {match.start()}")
+                match = token(match.end())
+
+        if is_object:
+            return PagedObject(self, start, match.end(), key_starts, starts, ends)
+        return PagedArray(self, start, match.end(), starts, ends)
+
+    def skip(self, start: int) -> int:
+        """Return the offset after the container opening at start, without building it."""
+        depth = 0
+        for match in _JSON_SKIP.finditer(self.mm, start):
+            # lastindex is only set when the opening bracket group matched
+            if match.lastindex:
+                depth += 1
+                if match.end() >= self._next_report:
+                    self._checkpoint(match.end())
+            else:
+                depth -= 1
+                if depth == 0:
+                    return match.end()
+        raise ValueError(f"Unterminated container starting at byte {start}")
+
+    def query(self, components: List[Any], start: int = 0):
+        """Yield (path, value) for each value matching parsed path components, in document order.
+
+        Only matching values are parsed, everything else is skipped over. A path
+        without wildcards has a single match, the scan stops once it is found.
+        Paths are relative to the value at start, the whole document by default.
+        """
+        single = PATH_WILDCARD not in components
+        pos = _JSON_WHITESPACE.match(self.mm, start).end()
+        for match in self._query(pos, components, ()):
+            yield match
+            if single:
+                return
+
+    def _parse_at(self, pos: int) -> Tuple[Any, int]:
+        """Parse the whole value at pos in one go, returns the value and the offset after it."""
+        match = self._token(pos)
+        string, punct, scalar = match.groups()
+        if string is not None or scalar is not None:
+            return json.loads(string or scalar), match.end()
+        if punct not in (b"{", b"["):
+            raise ValueError(f"Unexpected '{punct.decode()}' at byte {match.start(2)}")
+        start = match.start(2)
+        end = self.skip(start)
+        return parse_json(self.mm[start:end]), end
+
+    def _query(self, pos: int, components: List[Any], path: Tuple[Any, ...]):
+        """Yield the matches at or below the value at pos, returns the offset after the value."""
+        if not components:
+            value, end = self._parse_at(pos)
+            yield path, value
+            return end
+
+        match = self._token(pos)
+        punct = match.group(2)
+        if punct == b"{":
+            return (yield from self._query_object(match.end(), components, path))
+        if punct == b"[":
+            return (yield from self._query_array(match.end(), components, path))
+        if punct is not None:
+            raise ValueError(f"Unexpected '{punct.decode()}' at byte {match.start(2)}")
+        # A scalar, the rest of the path can't match below it
+        return match.end()
+
+    def _query_object(self, pos: int, components: List[Any], path: Tuple[Any, ...]):
+        component, rest = components[0], components[1:]
+        match = self._token(pos)
+        if match.group(2) == b"}":
+            return match.end()
+        while True:
+            if match.group(1) is None:
+                raise ValueError(f"Expected object key at byte {match.start()}")
+            key = json.loads(match.group(1))
+            colon = self._token(match.end())
+            if colon.group(2) != b":":
+                raise ValueError(f"Expected ':' at byte {colon.start()}")
+            if component is PATH_WILDCARD or key == component:
+                pos = yield from self._query(colon.end(), rest, path + (key,))
+            else:
+                pos = self._skip_value(colon.end())
+            match = self._token(pos)
+            if match.group(2) == b"}":
+                return match.end()
+            if match.group(2) != b",":
+                raise ValueError(f"Expected ',' or '}}' at byte {match.start()}")
+            match = self._token(match.end())
+
+    def _query_array(self, pos: int, components: List[Any], path: Tuple[Any, ...]):
+        component, rest = components[0], components[1:]
+        match = self._token(pos)
+        if match.group(2) == b"]":
+            return match.end()
+        index = 0
+        while True:
+            if component is PATH_WILDCARD or index == component:
+                pos = yield from self._query(pos, rest, path + (index,))
+            else:
+                pos = self._skip_value(pos)
+            match = self._token(pos)
+            if match.group(2) == b"]":
+                return match.end()
+            if match.group(2) != b",":
+                raise ValueError(f"Expected ',' or ']' at byte {match.start()}")
+            pos = match.end()
+            index += 1
+
+    def _skip_value(self, pos: int) -> int:
+        """Return the offset after the value at pos, without building it."""
+        match = self._token(pos)
+        punct = match.group(2)
+        if punct == b"{" or punct == b"[":
+            return self.skip(match.start(2))
+        if punct is not None:
+            raise ValueError(f"Unexpected '{punct.decode()}' at byte {match.start(2)}")
+        return match.end()
+
+
+class StoredNode:
+    """A container in a NodeStore, its children are read from the store when it's loaded."""
+
+    __slots__ = ("loader", "index")
+
+    def __init__(self, store: "NodeStore", index: int):
+        self.loader = store
+        self.index = index
+
+    @property
+    def start(self) -> int:
+        return self.loader.offsets[self.index]
+
+    @property
+    def end(self) -> int:
+        # Not stored, found by skipping over the container in the file
+        return self.loader.skip(self.start)
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+    @property
+    def is_object(self) -> bool:
+        return self.loader.types[self.index] == NODE_OBJECT
+
+    @property
+    def count(self) -> int:
+        return self.loader.counts[self.index]
+
+    def load(self) -> Union[Dict, List]:
+        """One level of the subtree: containers in it are StoredNodes again, scalars are decoded."""
+        return self.loader.load_node(self.index)
+
+
+class NodeStore(StreamingJSONLoader):
+    """A memory mapped JSON document tokenized into parallel arrays, one entry per node.
+
+    Nodes are numbered in document order. For each node the store keeps its
+    parent, key (an id into key_names, -1 for array items), type tag, offset of
+    its value in the file, number of children and number of descendants, about
+    25 bytes per node instead of the Python objects of a parsed document.
+    Scalars are decoded from the file only when their container is loaded.
+    """
+
+    def __init__(self, file_path: Path, mm: Union[mmap.mmap, None] = None):
+        super().__init__(file_path, mm)
+        self.parents = array('i')
+        self.keys = array('i')
+        self.types = array('B')
+        self.offsets = array('q')
+        self.counts = array('i')
+        self.descendants = array('i')
+        self.key_names: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the node arrays."""
+        return sum(len(a) * a.itemsize for a in (self.parents, self.keys, self.types, self.offsets,
+                                                 self.counts, self.descendants))
+
+    def tokenize(self, progress=None, cancel: Union[threading.Event, None] = None):
+        """Tokenize the document into the node arrays."""
+        self.progress = progress
+        self.cancel = cancel
+        self._next_report = 0
+        try:
+            pos = self._build()
+        finally:
+            self.progress = None
+            self.cancel = None
+        if _JSON_WHITESPACE.match(self.mm, pos).end() != len(self.mm):
+            raise ValueError(f"Extra data at byte {pos}")
+
+    def load(self, progress=None, cancel: Union[threading.Event, None] = None) -> Any:
+        """Tokenize the document into the node arrays, returns the first level of the document."""
+        self.tokenize(progress, cancel)
+        # The root level is always loaded, like with the streaming loader
+        return self.value(0).load() if self.counts[0] else self.value(0)
+
+    def _build(self) -> int:
+        """Append every node of the document to the arrays, returns the offset after the document."""
+        # Hot loop, look up everything once
+        token = self._token
+        parents, keys, types = self.parents, self.keys, self.types
+        offsets, counts, descendants = self.offsets, self.counts, self.descendants
+        key_names = self.key_names
+        key_ids: Dict[bytes, int] = {}
+        # Containers not closed yet, innermost last
+        open_nodes: List[int] = []
+        parent = -1
+        pos = 0
+        key_id = -1
+
+        def key_id_of(raw_key: bytes) -> int:
+            key_id = key_ids.get(raw_key)
+            if key_id is None:
+                key_id = key_ids[raw_key] = len(key_names)
+                key_names.append(json.loads(raw_key))
+            return key_id
+
+        while True:
+            match = token(pos)
+            kind = match.lastindex
+            node = len(types)
+            parents.append(parent)
+            keys.append(key_id)
+            counts.append(0)
+            descendants.append(0)
+            if parent >= 0:
+                counts[parent] += 1
+            opened = False
+            if kind == 1:
+                types.append(NODE_STRING)
+                offsets.append(match.start(1))
+            elif kind == 3:
+                types.append(_SCALAR_TAGS.get(match.group(3)[:1], NODE_NUMBER))
+                offsets.append(match.start(3))
+            else:
+                punct = match.group(2)
+                if punct != b"{" and punct != b"[":
+                    raise ValueError(f"Unexpected '{punct.decode()}' at byte {match.start(2)}")
+                types.append(NODE_OBJECT if punct == b"{" else NODE_ARRAY)
+                offsets.append(match.start(2))
+                open_nodes.append(node)
+                parent = node
+                opened = True
+            pos = match.end()
+            if pos >= self._next_report:
+                self._checkpoint(pos)
+
+            # Close the containers ending here, then step over the ',' before the next value
+            while open_nodes:
+                container = open_nodes[-1]
+                closer = b"}" if types[container] == NODE_OBJECT else b"]"
+                match = token(pos)
+                punct = match.group(2)
+                if punct == closer:
+                    descendants[container] = len(types) - container - 1
+                    open_nodes.pop()
+                    pos = match.end()
+                    opened = False
+                    continue
+                if opened:
+                    # First value of a container that was just opened, no ',' before it
+                    break
+                if punct != b",":
+                    raise ValueError(f"Expected ',' or '{closer.decode()}' at byte {match.start()}")
+                pos = match.end()
+                break
+            else:
+                return pos
+
+            parent = open_nodes[-1]
+            if types[parent] == NODE_OBJECT:
+                match = token(pos)
+                if match.lastindex != 1:
+                    raise ValueError(f"Expected object key at byte {match.start()}")
+                key_id = key_id_of(match.group(1))
+                colon = token(match.end())
+                if colon.group(2) != b":":
+                    raise ValueError(f"Expected ':' at byte {colon.start()}")
+                pos = colon.end()
+            else:
+                key_id = -1
+
+    def children(self, index: int):
+        """Yield the node ids of the children of a container, in document order."""
+        descendants = self.descendants
+        child = index + 1
+        for _ in range(self.counts[index]):
+            yield child
+            child += descendants[child] + 1
+
+    def value(self, index: int) -> Any:
+        """Value of a node, a StoredNode for non-empty containers."""
+        tag = self.types[index]
+        if tag == NODE_STRING or tag == NODE_NUMBER:
+            match = _JSON_TOKEN.match(self.mm, self.offsets[index])
+            return decode_token(match.group(1) if tag == NODE_STRING else match.group(3))
+        if tag <= NODE_ARRAY:
+            if self.counts[index]:
+                return StoredNode(self, index)
+            return {} if tag == NODE_OBJECT else []
+        return _SCALAR_VALUES[tag]
+
+    def load_node(self, index: int) -> Union[Dict, List]:
+        value = self.value
+        if self.types[index] == NODE_OBJECT:
+            keys = self.keys
+            key_names = self.key_names
+            return {key_names[keys[child]]: value(child) for child in self.children(index)}
+        return [value(child) for child in self.children(index)]
+
+
+# Lazily loaded containers of the streaming loader and the node store
+LAZY_NODES = (LazyNode, StoredNode)
+# Nodes backed by a byte span of a memory mapped file
+SPAN_NODES = LAZY_NODES + (PagedObject, PagedArray)
+
+
+# Marks a '*' component of a path query, matching every child of a node
+PATH_WILDCARD = object()
+_PATH_COMPONENT = re.compile(r'\.([^.\[\]]+)|\[(\d+|\*)\]|\[("(?:[^"\\]|\\.)*")\]|\[\'([^\']*)\'\]')
+
+
+def parse_path(expression: str) -> List[Any]:
+    """Split a JSONPath-style expression like $.items[*].metadata["name"] into components."""
+    if not expression.startswith("$"):
+        raise ValueError(f"Path must start with '$': {expression}")
+    components = []
+    pos = 1
+    while pos < len(expression):
+        match = _PATH_COMPONENT.match(expression, pos)
+        if match is None:
+            raise ValueError(f"Invalid path at position {pos}: {expression}")
+        name, index, quoted, single_quoted = match.groups()
+        if name is not None:
+            components.append(PATH_WILDCARD if name == "*" else name)
+        elif index is not None:
+            components.append(PATH_WILDCARD if index == "*" else int(index))
+        elif quoted is not None:
+            components.append(json.loads(quoted))
+        else:
+            components.append(single_quoted)
+        pos = match.end()
+    return components
+
+
+def dump_json(value: Any) -> str:
+    """json.dumps(value, ensure_ascii=False, default=str) for a value nested at any depth.
+
+    Values nested deeper than the recursive encoder allows are written with an
+    explicit stack of the containers being written instead.
+    """
+    try:
+        return json.dumps(value, ensure_ascii=False, default=str)
+    except RecursionError:
+        pass
+
+    end = object()
+    parts: List[str] = []
+    # [items left, closing bracket, is an object, no item written yet], innermost last
+    stack: List[List[Any]] = []
+
+    def open_value(item: Any):
+        if isinstance(item, dict) and item:
+            parts.append("{")
+            stack.append([iter(item.items()), "}", True, True])
+        elif isinstance(item, (list, tuple)) and item:
+            parts.append("[")
+            stack.append([iter(item), "]", False, True])
+        else:
+            parts.append(json.dumps(item, ensure_ascii=False, default=str))
+
+    open_value(value)
+    while stack:
+        entry = stack[-1]
+        item = next(entry[0], end)
+        if item is end:
+            parts.append(entry[1])
+            stack.pop()
+            continue
+        if not entry[3]:
+            parts.append(", ")
+        entry[3] = False
+        if entry[2]:
+            key, item = item
+            if not isinstance(key, str):
+                # Keys are converted like json.dumps does, other types by str()
+                key = json.dumps(key) if key is None or isinstance(key, (int, float)) else str(key)
+            parts.append(json.dumps(key, ensure_ascii=False) + ": ")
+        open_value(item)
+    return "".join(parts)
+
+
+def format_path(path: Tuple[Any, ...]) -> str:
+    """Format a path of keys/indexes as a JSONPath-style string."""
+    parts = ["$"]
+    for key in path:
+        if isinstance(key, int):
+            parts.append(f"[{key}]")
+        elif isinstance(key, str) and key.isidentifier():
+            parts.append(f".{key}")
+        else:
+            parts.append(f"[{json.dumps(str(key))}]")
+    return "".join(parts)
+
+
+def find_paths(data: Any, components: List[Any], path: Tuple[Any, ...] = ()):
+    """Yield the paths in data matching the parsed path components, lazy nodes are parsed as needed."""
+    if not components:
+        yield path
+        return
+    data = TreeVisualizer.resolve(data)
+    component, rest = components[0], components[1:]
+    if isinstance(data, OBJECT_TYPES):
+        if component is PATH_WILDCARD:
+            for key, value in data.items():
+                yield from find_paths(value, rest, path + (key,))
+        elif component in data:
+            yield from find_paths(data[component], rest, path + (component,))
+    elif isinstance(data, ARRAY_TYPES):
+        if component is PATH_WILDCARD:
+            for i, item in enumerate(data):
+                yield from find_paths(item, rest, path + (i,))
+        elif isinstance(component, int) and component < len(data):
+            yield from find_paths(data[component], rest, path + (component,))
+
+
+def get_path(data: Any, path: Tuple[Any, ...]) -> Any:
+    """Return the value at path, lazy nodes along the way are parsed."""
+    for key in path:
+        data = TreeVisualizer.resolve(data)[key]
+    return data
+
+
+class DocumentIndex:
+    """Search index and subtree statistics of a document.
+
+    Nodes are numbered in document order, with their parent and key kept in
+    parallel arrays: a key is an id into key_names, an array item stores its
+    position as -2 - position and the root -1. The lower cased scalar values
+    of all nodes are appended to one UTF-8 vocabulary, each after a newline,
+    which is scanned with find() for substring and prefix queries; a hit maps
+    to its node through the term start offsets. Key names are matched the same
+    way once each, and map to their nodes through postings sorted by key id.
+    There is no Python object per node, so the index stays a few arrays and a
+    byte string about the size of the scalar data. A NodeStore is indexed from
+    its node arrays, which cover the whole file no matter how much of the
+    document has been loaded.
+    """
+
+    def __init__(self, data: Any, cancel: Union[threading.Event, None] = None):
+        self.parents = array('i')
+        self.keys = array('i')
+        self.key_names: List[Any] = []
+        # Every scalar value in node order: its offset in the vocabulary and its node
+        self._vocabulary = bytearray(b"\n")
+        self._term_starts = array('q')
+        self._term_nodes = array('i')
+        # Approximate compact JSON size of each node, without its children
+        self.sizes = array('q')
+
+        if isinstance(data, NodeStore):
+            self._index_store(data, cancel)
+            # Counted by the store while tokenizing
+            self.descendants = data.descendants
+        else:
+            self._index_value(data, cancel)
+            self.descendants = None
+        self._compute_stats()
+        self._index_keys()
+
+    def _add_term(self, node_id: int, term: str):
+        if not term:
+            return
+        self._term_starts.append(len(self._vocabulary))
+        self._term_nodes.append(node_id)
+        # Newline terminated, a hit can't span two terms
+        self._vocabulary += term.replace("\n", " ").encode('utf-8') + b"\n"
+
+    def _index_value(self, data: Any, cancel: Union[threading.Event, None]):
+        """Index a parsed document."""
+        key_ids: Dict[Tuple[type, Any], int] = {}
+        # (value, parent node, key code)
+        stack = [(data, -1, -1)]
+        while stack:
+            value, parent, key = stack.pop()
+            node_id = len(self.keys)
+            self.parents.append(parent)
+            self.keys.append(key)
+            if not node_id % 65536:
+                _check_cancelled(cancel)
+
+            if isinstance(value, dict):
+                for child_key, child in reversed(list(value.items())):
+                    key_id = key_ids.get((type(child_key), child_key))
+                    if key_id is None:
+                        key_id = key_ids[(type(child_key), child_key)] = len(self.key_names)
+                        self.key_names.append(child_key)
+                    stack.append((child, node_id, key_id))
+                # Brackets, commas and the '"key":' of every member
+                self.sizes.append(1 + len(value) * 4 + sum(len(str(k).encode('utf-8')) for k in value)
+                                  if value else 2)
+            elif isinstance(value, list):
+                stack.extend((value[i], node_id, -2 - i) for i in range(len(value) - 1, -1, -1))
+                self.sizes.append(1 + len(value) if value else 2)
+            else:
+                self._add_term(node_id, self._scalar_term(value))
+                self.sizes.append(self._scalar_size(value))
+
+    def _index_store(self, store: "NodeStore", cancel: Union[threading.Event, None]):
+        """Index all nodes of a node store, scalars are decoded from the file once each."""
+        # Hot loop, look up everything once
+        parents, keys, types, offsets, counts = store.parents, store.keys, store.types, store.offsets, store.counts
+        mm = store.mm
+        match_token = _JSON_TOKEN.match
+        vocabulary, term_starts, term_nodes = self._vocabulary, self._term_starts, self._term_nodes
+        sizes = self.sizes
+        # The '"key":' and ',' a member adds to its object, as for a parsed document
+        key_sizes = [len(str(name).encode('utf-8')) + 4 for name in store.key_names]
+        # Containers along the current path and the position of their next child, innermost last
+        open_nodes = [-1]
+        positions = [0]
+
+        # Shared with the store, they're never changed
+        self.parents = parents
+        self.key_names = store.key_names
+        index_keys = self.keys
+        for node_id in range(len(types)):
+            if not node_id % 65536:
+                _check_cancelled(cancel)
+            parent = parents[node_id]
+            while open_nodes[-1] != parent:
+                open_nodes.pop()
+                positions.pop()
+            key_id = keys[node_id]
+            if key_id >= 0:
+                index_keys.append(key_id)
+                sizes[parent] += key_sizes[key_id]
+            elif parent >= 0:
+                position = positions[-1]
+                positions[-1] = position + 1
+                index_keys.append(-2 - position)
+                sizes[parent] += 1
+            else:
+                index_keys.append(-1)
+
+            tag = types[node_id]
+            if tag <= NODE_ARRAY:
+                if counts[node_id]:
+                    sizes.append(1)
+                    open_nodes.append(node_id)
+                    positions.append(0)
+                else:
+                    sizes.append(2)
+                continue
+            if tag == NODE_STRING:
+                raw = match_token(mm, offsets[node_id]).group(1)
+                # As written in the file, the exact compact JSON size
+                sizes.append(len(raw))
+                term = decode_token(raw).lower()
+            elif tag == NODE_NUMBER:
+                raw = match_token(mm, offsets[node_id]).group(3)
+                sizes.append(len(raw))
+                # Formatted like a parsed number, 1.50 and 1.5 are the same term
+                term = str(decode_token(raw)).lower()
+            else:
+                term = self._scalar_term(_SCALAR_VALUES[tag])
+                sizes.append(len(term))
+            if term:
+                term_starts.append(len(vocabulary))
+                term_nodes.append(node_id)
+                vocabulary += term.replace("\n", " ").encode('utf-8') + b"\n"
+
+    def _index_keys(self):
+        """Vocabulary of the key names and the nodes of each key, ordered by key id then node id."""
+        terms = [(str(name).lower().replace("\n", " ") + "\n").encode('utf-8') for name in self.key_names]
+        self._key_vocabulary = b"\n" + b"".join(terms)
+        self._key_starts = array('q', itertools.accumulate((len(term) for term in terms[:-1]), initial=1))
+        counts = array('q', [0]) * (len(self.key_names) + 1)
+        for key in self.keys:
+            if key >= 0:
+                counts[key + 1] += 1
+        self._key_postings_start = starts = array('q', itertools.accumulate(counts))
+        fill = array('q', starts)
+        self._key_postings = postings = array('i', [0]) * starts[-1]
+        for node_id, key in enumerate(self.keys):
+            if key >= 0:
+                postings[fill[key]] = node_id
+                fill[key] += 1
+
+    def _compute_stats(self):
+        """Turn the node sizes into subtree sizes, and count descendants (unless known) and subtree heights.
+
+        Children always have higher ids than their parent, so walking the ids
+        backwards is a post-order pass: every node is complete before its parent.
+        """
+        parents = self.parents
+        sizes = self.sizes
+        self.heights = heights = array('i', [0]) * len(parents)
+        if self.descendants is None:
+            self.descendants = descendants = array('i', [0]) * len(parents)
+            for node_id in range(len(parents) - 1, 0, -1):
+                descendants[parents[node_id]] += descendants[node_id] + 1
+        for node_id in range(len(parents) - 1, 0, -1):
+            parent = parents[node_id]
+            sizes[parent] += sizes[node_id]
+            if heights[node_id] >= heights[parent]:
+                heights[parent] = heights[node_id] + 1
+
+    def heaviest(self, limit: int = HEAVIEST_LIMIT) -> List[int]:
+        """Ids of the largest subtrees below the root, by size."""
+        return heapq.nlargest(limit, range(1, len(self.parents)), key=self.sizes.__getitem__)
+
+    @staticmethod
+    def _scalar_size(value: Any) -> int:
+        if isinstance(value, str):
+            # Quotes, escaped characters are not accounted for
+            return len(value.encode('utf-8')) + 2
+        if value is None or value is True:
+            return 4
+        if value is False:
+            return 5
+        return len(str(value))
+
+    @staticmethod
+    def _scalar_term(value: Any) -> str:
+        if value is None:
+            return "null"
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        return str(value).lower()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @staticmethod
+    def _find_terms(vocabulary: bytes, term_starts: array, query: bytes, prefix: bool):
+        """Indexes of the terms in vocabulary containing (or starting with) query, in order."""
+        # A prefix hit includes the newline before the term
+        needle = b"\n" + query if prefix else query
+        skip = 1 if prefix else 0
+        pos = vocabulary.find(needle)
+        while pos != -1:
+            term = bisect.bisect_right(term_starts, pos + skip) - 1
+            yield term
+            if term + 1 >= len(term_starts):
+                return
+            pos = vocabulary.find(needle, term_starts[term + 1] - skip)
+
+    def _key_nodes(self, key_id: int):
+        postings = self._key_postings
+        for i in range(self._key_postings_start[key_id], self._key_postings_start[key_id + 1]):
+            yield postings[i]
+
+    def search(self, query: str, prefix: bool = False, limit: int = SEARCH_LIMIT) -> List[int]:
+        """Ids of nodes whose key or value contains (or starts with) query, in document order."""
+        query = query.lower().replace("\n", " ").encode('utf-8')
+        if not query:
+            return []
+        term_nodes = self._term_nodes
+        value_nodes = (term_nodes[term] for term in
+                       self._find_terms(self._vocabulary, self._term_starts, query, prefix))
+        key_nodes = [self._key_nodes(key_id) for key_id in
+                     self._find_terms(self._key_vocabulary, self._key_starts, query, prefix)]
+        nodes: List[int] = []
+        for node_id in heapq.merge(value_nodes, *key_nodes):
+            # A node can match by key and value
+            if not nodes or nodes[-1] != node_id:
+                nodes.append(node_id)
+                if len(nodes) >= limit:
+                    break
+        return nodes
+
+    def path(self, node_id: int) -> Tuple[Any, ...]:
+        """Keys/indexes leading from the root to a node."""
+        path = []
+        while self.parents[node_id] >= 0:
+            key = self.keys[node_id]
+            path.append(self.key_names[key] if key >= 0 else -2 - key)
+            node_id = self.parents[node_id]
+        return tuple(reversed(path))
+
+
+class DiffNode:
+    """One node of a structural diff.
+
+    status is 'same', 'added', 'removed', 'changed' (another value) or
+    'modified' (a container with changes below it). Only modified nodes have
+    children, their unchanged children are only counted.
+    """
+
+    __slots__ = ("status", "old", "new", "children", "unchanged")
+
+    def __init__(self, status: str, old: Any = None, new: Any = None):
+        self.status = status
+        self.old = old
+        self.new = new
+        self.children: List[Tuple[str, "DiffNode"]] = []
+        self.unchanged = 0
+
+    def add(self, label: str, child: "DiffNode"):
+        if child.status == "same":
+            self.unchanged += 1
+        else:
+            self.children.append((label, child))
+
+
+class TreeDiff:
+    """Structural diff of two documents.
+
+    Every subtree is hashed once (dict hashes don't depend on key order), so
+    identical subtrees are skipped without being walked and the diff is linear
+    in the document size. Subtrees of a streaming load are hashed by their
+    bytes in the file and only opened when they differ. Lists of objects are
+    matched by an identifying key (see DIFF_MATCH_KEYS) when all items have a
+    unique one, else by a sequence match of the item hashes. Hashing and
+    diffing work through explicit stacks, so any nesting depth works.
+    """
+
+    def __init__(self, old: Any, new: Any):
+        # id() -> (container, hash), the container is kept so that its id can't be reused
+        self._hashes: Dict[int, Tuple[Any, int]] = {}
+        self.counts = {"added": 0, "removed": 0, "changed": 0}
+        # Modified nodes whose children are not diffed yet
+        self._pending: List[DiffNode] = []
+        self.root = self._compare(old, new)
+        while self._pending:
+            self._expand(self._pending.pop())
+        self._prune()
+
+    def _hash(self, value: Any) -> int:
+        if isinstance(value, SPAN_NODES):
+            return self._span_hash(value)
+        if not isinstance(value, (dict, list)):
+            try:
+                return hash((type(value).__name__, value))
+            except TypeError:
+                return hash((type(value).__name__, repr(value)))
+
+        cached = self._hashes.get(id(value))
+        if cached is not None:
+            return cached[1]
+        # Post-order, a container is hashed once all containers in it are
+        stack = [(value, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if id(node) in self._hashes:
+                continue
+            if not children_done:
+                stack.append((node, True))
+                stack.extend((child, False) for child in (node.values() if isinstance(node, dict) else node)
+                             if isinstance(child, (dict, list)) and id(child) not in self._hashes)
+                continue
+            if isinstance(node, dict):
+                node_hash = hash(("{}", sum(hash((key, self._hash(child))) for key, child in node.items())))
+            else:
+                node_hash = hash(("[]",) + tuple(self._hash(item) for item in node))
+            self._hashes[id(node)] = (node, node_hash)
+        return self._hashes[id(value)][1]
+
+    @staticmethod
+    def _span_hash(value: Any) -> int:
+        """Hash of the bytes of a streamed subtree, which is compared only once so it isn't cached.
+
+        Same bytes, same subtree. Differently formatted equal subtrees are compared when opened.
+        """
+        # Hashed in place, a slice of the map would copy the whole subtree
+        with memoryview(value.loader.mm) as view, view[value.start:value.end] as span:
+            return int.from_bytes(hashlib.blake2b(span, digest_size=8).digest(), 'little')
+
+    def _item_hash(self, item: Any) -> int:
+        """Hash of a list item for aligning lists, streamed items are hashed without their whitespace."""
+        if not isinstance(item, LAZY_NODES):
+            return self._hash(item)
+        mm = item.loader.mm
+        return hash(_JSON_INSIGNIFICANT.sub(rb"\1", mm[item.start:item.end]))
+
+    def _node(self, status: str, old: Any = None, new: Any = None) -> DiffNode:
+        self.counts[status] += 1
+        return DiffNode(status, old, new)
+
+    def _prune(self):
+        """Count modified nodes without changes below them as unchanged.
+
+        Streamed subtrees that only differ in formatting or key order have
+        different hashes, they are opened to find that all their children match.
+        """
+        # Parents before their children, reversed it is bottom-up
+        modified = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.status == "modified":
+                modified.append(node)
+                stack.extend(child for _, child in node.children)
+        for node in reversed(modified):
+            children = [(label, child) for label, child in node.children
+                        if child.status != "modified" or child.children]
+            node.unchanged += len(node.children) - len(children)
+            node.children = children
+        if self.root.status == "modified" and not self.root.children:
+            self.root.status = "same"
+
+    def _compare(self, old: Any, new: Any) -> DiffNode:
+        """Diff node of two values, containers that differ are queued to be expanded."""
+        if self._hash(old) == self._hash(new):
+            return DiffNode("same", old, new)
+
+        old = TreeVisualizer.resolve(old)
+        new = TreeVisualizer.resolve(new)
+        if ((isinstance(old, OBJECT_TYPES) and isinstance(new, OBJECT_TYPES))
+                or (isinstance(old, ARRAY_TYPES) and isinstance(new, ARRAY_TYPES))):
+            node = DiffNode("modified", old, new)
+            self._pending.append(node)
+            return node
+        return self._node("changed", old, new)
+
+    def _expand(self, node: DiffNode):
+        """Add the children of a modified node."""
+        old, new = node.old, node.new
+        if isinstance(old, ARRAY_TYPES):
+            self._diff_lists(node)
+            return
+        for key, value in new.items():
+            if key in old:
+                node.add(str(key), self._compare(old[key], value))
+            else:
+                node.add(str(key), self._node("added", new=value))
+        for key, value in old.items():
+            if key not in new:
+                node.add(str(key), self._node("removed", old=value))
+
+    def _diff_lists(self, node: DiffNode):
+        # Items of a streamed array stay lazy, their keys are read from the file
+        old_items = list(node.old)
+        new_items = list(node.new)
+
+        match = self._match_key(old_items, new_items)
+        if match:
+            match_key, old_keys, new_keys = match
+            key_name = ".".join(match_key)
+            old_by_key = {key: (i, item) for i, (key, item) in enumerate(zip(old_keys, old_items))}
+            for i, (key, item) in enumerate(zip(new_keys, new_items)):
+                label = f"[{i}] {key_name}={key}"
+                if key in old_by_key:
+                    node.add(label, self._compare(old_by_key.pop(key)[1], item))
+                else:
+                    node.add(label, self._node("added", new=item))
+            for key, (i, item) in old_by_key.items():
+                node.add(f"[{i}] {key_name}={key}", self._node("removed", old=item))
+            return
+
+        matcher = difflib.SequenceMatcher(None, [self._item_hash(item) for item in old_items],
+                                          [self._item_hash(item) for item in new_items], autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                node.unchanged += i2 - i1
+                continue
+            # Replaced items are compared pairwise, the remainder is added or removed
+            for offset in range(max(i2 - i1, j2 - j1)):
+                i, j = i1 + offset, j1 + offset
+                if i < i2 and j < j2:
+                    node.add(f"[{j}]", self._compare(old_items[i], new_items[j]))
+                elif j < j2:
+                    node.add(f"[{j}]", self._node("added", new=new_items[j]))
+                else:
+                    node.add(f"[{i}]", self._node("removed", old=old_items[i]))
+
+    @staticmethod
+    def _is_object(item: Any) -> bool:
+        return isinstance(item, OBJECT_TYPES) or (isinstance(item, LAZY_NODES) and item.is_object)
+
+    @staticmethod
+    def _item_key(item: Any, key_path: Tuple[str, ...]) -> Any:
+        if isinstance(item, LAZY_NODES):
+            # Scanned in the file up to the key, the item isn't loaded
+            match = next(item.loader.query(list(key_path), item.start), None)
+            item = match[1] if match else None
+        else:
+            for key in key_path:
+                if not isinstance(item, OBJECT_TYPES) or key not in item:
+                    return None
+                item = TreeVisualizer.resolve(item[key])
+        return item if isinstance(item, (str, int, float, bool)) else None
+
+    def _match_key(self, old: List, new: List) -> Union[Tuple[Tuple[str, ...], List, List], None]:
+        """First of DIFF_MATCH_KEYS that identifies every item in both lists and the item keys, if any."""
+        if not old or not new:
+            return None
+        if not all(self._is_object(item) for item in itertools.chain(old, new)):
+            return None
+        for key_path in DIFF_MATCH_KEYS:
+            item_keys = []
+            for items in (old, new):
+                keys = [self._item_key(item, key_path) for item in items]
+                if None in keys or len(set(keys)) != len(keys):
+                    break
+                item_keys.append(keys)
+            else:
+                return key_path, item_keys[0], item_keys[1]
+        return None
+
 
 class TreeVisualizer:
     """Main class for visualizing YAML/JSON data structures as trees."""
@@ -30,8 +1307,24 @@ class TreeVisualizer:
     def __init__(self):
         self.data = None
         self.file_path = None
+        self.loader = None
+        self.index = None
+
+    def close(self):
+        """Release the memory map held by a streaming load."""
+        if self.loader:
+            self.loader.close()
+            self.loader = None
 
-    def load_file(self, file_path: str) -> bool:
+    def load_file(self, file_path: str, stream: bool = False, progress=None,
+                  cancel: Union[threading.Event, None] = None, compact: bool = False) -> bool:
+        """Load a JSON/YAML file.
+
+        progress(bytes_done, bytes_total) is called while the file is consumed, with
+        bytes_done None while a parser runs that can't report progress. Setting the
+        cancel event aborts the load, a non-streaming parse is only checked once done.
+        With compact a JSON file is loaded into a NodeStore.
+        """
         try:
             self.file_path = Path(file_path)
 
@@ -39,29 +1332,238 @@ class TreeVisualizer:
                 print(f"Error: File '{file_path}' not found")
                 return False
 
-            with open(self.file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            self.close()
+            self.index = None
+            file_size = self.file_path.stat().st_size
+            file_format = detect_format(self.file_path)
+            if file_format == "json" and (stream or compact or file_size >= STREAMING_THRESHOLD):
+                if self._load_streaming(progress, cancel, compact):
+                    return True
 
-            # Try to parse as JSON first, then YAML
-            try:
-                self.data = json.loads(content)
-                print(f"Loaded as JSON: {self.file_path}")
-            except json.JSONDecodeError:
+            chunks = []
+            with open(self.file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(PROGRESS_STEP), b""):
+                    _check_cancelled(cancel)
+                    chunks.append(chunk)
+                    if progress:
+                        progress(f.tell(), file_size)
+            content = b"".join(chunks)
+            del chunks
+            if progress:
+                progress(None, file_size)
+
+            # Detected format first, the others are fallbacks when it doesn't parse
+            errors = []
+            for parse_format in PARSE_ORDER[file_format]:
                 try:
-                    self.data = yaml.safe_load(content)
-                    print(f"Loaded as YAML: {self.file_path}")
-                except yaml.YAMLError as e:
-                    print(f"Error parsing YAML: {e}")
-                    return False
+                    self.data, description = parse_content(content, parse_format)
+                    print(f"Loaded as {description}: {self.file_path}")
+                    break
+                except (ValueError, yaml.YAMLError) as e:
+                    errors.append(e)
+            else:
+                print(f"Error parsing {FORMAT_NAMES[file_format]}: {errors[0]}")
+                return False
 
+            _check_cancelled(cancel)
             return True
 
+        except LoadCancelled:
+            self.data = None
+            self.close()
+            print(f"Loading cancelled: {self.file_path}")
+            return False
         except Exception as e:
             print(f"Error loading file: {e}")
             return False
 
+    def _load_streaming(self, progress=None, cancel: Union[threading.Event, None] = None,
+                        compact: bool = False) -> bool:
+        """Load a JSON file with the streaming loader (or into a node store), False if it isn't streamable JSON."""
+        with open(self.file_path, 'rb') as f:
+            head = f.read(4096).lstrip()
+        if not head.startswith((b"{", b"[")):
+            return False
+
+        loader = NodeStore(self.file_path) if compact else StreamingJSONLoader(self.file_path)
+        try:
+            self.data = loader.load(progress, cancel)
+        except ValueError as e:
+            loader.close()
+            print(f"{'Compact' if compact else 'Streaming'} JSON load failed ({e}), loading whole file")
+            return False
+        except LoadCancelled:
+            loader.close()
+            raise
+
+        self.loader = loader
+        if compact:
+            print(f"Loaded as JSON (compact, {len(loader)} nodes in {self._format_size(loader.nbytes)}): "
+                  f"{self.file_path}")
+        else:
+            print(f"Loaded as JSON (streaming): {self.file_path}")
+        return True
+
+    def build_index(self, cancel: Union[threading.Event, None] = None):
+        """Build the search index and subtree statistics of the loaded data.
+
+        A streamed file is tokenized into a NodeStore for it, so the index covers
+        all of it and not only the subtrees opened so far.
+        """
+        if isinstance(self.loader, NodeStore):
+            self.index = DocumentIndex(self.loader, cancel)
+        elif self.loader:
+            # On the mapping of the loader, the file isn't mapped (and resident) twice
+            store = NodeStore(self.file_path, self.loader.mm)
+            try:
+                store.tokenize(cancel=cancel)
+                self.index = DocumentIndex(store, cancel)
+            finally:
+                store.close()
+        else:
+            self.index = DocumentIndex(self.data, cancel)
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> List[Tuple[Any, ...]]:
+        """Paths of the nodes matching query.
+
+        A query starting with '$' is a path ($.items[*].name), one starting with
+        '^' matches keys/values by prefix, anything else is a substring match.
+        """
+        if query.startswith("$"):
+            return list(itertools.islice(find_paths(self.data, parse_path(query)), limit))
+        if self.index is None:
+            self.build_index()
+        prefix = query.startswith("^")
+        nodes = self.index.search(query[1:] if prefix else query, prefix, limit)
+        return [self.index.path(node_id) for node_id in nodes]
+
+    def print_search(self, query: str, out: TextIO = None):
+        """Print the paths and values of the nodes matching query."""
+        out = out or sys.stdout
+        paths = self.search(query)
+        for path in paths:
+            out.write(f"{format_path(path)}: {self._format_value(get_path(self.data, path))}\n")
+        if len(paths) >= SEARCH_LIMIT:
+            out.write(f"... (showing the first {SEARCH_LIMIT} matches)\n")
+        elif not paths:
+            out.write(f"No matches for: {query}\n")
+
+    def print_stats(self, out: TextIO = None, limit: int = HEAVIEST_LIMIT):
+        """Print document totals and the heaviest subtrees."""
+        out = out or sys.stdout
+        if self.index is None:
+            self.build_index()
+        index = self.index
+        total_size = index.sizes[0] or 1
+
+        out.write(f"\nStatistics of: {self.file_path}\n")
+        out.write("=" * 50 + "\n")
+        out.write(f"Nodes:     {len(index)}\n")
+        out.write(f"Max depth: {index.heights[0]}\n")
+        out.write(f"Size:      {self._format_size(index.sizes[0])} (compact JSON)\n")
+        out.write("\nHeaviest subtrees:\n")
+        out.write(f"{'size':>10} {'share':>6} {'nodes':>10} {'depth':>6}  path\n")
+        for node_id in index.heaviest(limit):
+            out.write(f"{self._format_size(index.sizes[node_id]):>10} "
+                      f"{100 * index.sizes[node_id] / total_size:>5.1f}% "
+                      f"{index.descendants[node_id] + 1:>10} {index.heights[node_id]:>6}  "
+                      f"{format_path(index.path(node_id))}\n")
+
+    def print_diff(self, other: "TreeVisualizer", out: TextIO = None):
+        """Print a colour coded structural diff from this document to other."""
+        out = out or sys.stdout
+        color = hasattr(out, "isatty") and out.isatty()
+        diff = TreeDiff(self.data, other.data)
+
+        out.write(f"\nDiff of: {self.file_path} -> {other.file_path}\n")
+        out.write("=" * 50 + "\n")
+        if diff.root.status == "same":
+            out.write("No differences\n")
+            return
+        if diff.root.status == "modified":
+            self._write_diff(diff.root, out, color)
+        else:
+            out.write(self._diff_line("", "root", diff.root, color))
+        counts = diff.counts
+        out.write(f"\n{counts['added']} added, {counts['removed']} removed, {counts['changed']} changed\n")
+
+    def _diff_line(self, prefix: str, label: str, node: DiffNode, color: bool) -> str:
+        if node.status == "added":
+            text = self._format_value(node.new)
+        elif node.status == "removed":
+            text = self._format_value(node.old)
+        elif node.status == "changed":
+            text = f"{self._format_value(node.old)} -> {self._format_value(node.new)}"
+        else:
+            text = self._format_value(node.new)
+        line = f"{DIFF_MARKERS[node.status]} {label}: {text}"
+        if color:
+            line = f"{DIFF_COLORS[node.status]}{line}\033[0m"
+        return f"{prefix}{line}\n"
+
+    def _write_diff(self, root: DiffNode, out: TextIO, color: bool):
+        """Write the changed part of a diff tree, the same way _write_tree() writes a document."""
+        def entries(node: DiffNode):
+            last = len(node.children) - (0 if node.unchanged else 1)
+            for i, (label, child) in enumerate(node.children):
+                yield label, child, i == last
+            if node.unchanged:
+                yield None, node.unchanged, True
+
+        lines = []
+        stack = [(entries(root), "")]
+        while stack:
+            children, prefix = stack[-1]
+            entry = next(children, None)
+            if entry is None:
+                stack.pop()
+                continue
+
+            label, child, is_last = entry
+            branch = prefix + ("└── " if is_last else "├── ")
+            if label is None:
+                lines.append(f"{branch}... {child} unchanged\n")
+            else:
+                lines.append(self._diff_line(branch, label, child, color))
+                if child.status == "modified":
+                    stack.append((entries(child), prefix + ("    " if is_last else "│   ")))
+            if len(lines) >= OUTPUT_BATCH:
+                out.write("".join(lines))
+                lines.clear()
+
+        out.write("".join(lines))
+
+    @staticmethod
+    def resolve(value: Any) -> Any:
+        """Return the parsed subtree of a lazy node, other values are returned as is."""
+        return value.load() if isinstance(value, LAZY_NODES) else value
+
+    @staticmethod
+    def _is_expandable(value: Any) -> bool:
+        return isinstance(value, LAZY_NODES) or (isinstance(value, CONTAINER_TYPES) and bool(value))
+
+    @staticmethod
+    def _type_name(value: Any) -> str:
+        if isinstance(value, LAZY_NODES):
+            return "dict" if value.is_object else "list"
+        return type(value).__name__
+
+    @staticmethod
+    def _format_size(size: int) -> str:
+        for unit in ("B", "KB", "MB"):
+            if size < 1024:
+                return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+            size /= 1024
+        return f"{size:.1f} GB"
+
     def _format_value(self, value: Any) -> str:
         """Format a value for display in the tree."""
+        if isinstance(value, StoredNode):
+            type_name = "object" if value.is_object else "array"
+            return f"{type_name} ({value.count} items)"
+        if isinstance(value, LazyNode):
+            type_name = "object" if value.is_object else "array"
+            return f"{type_name} (not loaded, {self._format_size(value.size)})"
         if isinstance(value, str):
             if len(value) > 50:
                 return f'"{value[:47]}..."'
@@ -70,57 +1572,211 @@ class TreeVisualizer:
             return str(value)
         elif value is None:
             return "null"
-        elif isinstance(value, (list, dict)):
+        elif isinstance(value, CONTAINER_TYPES):
             count = len(value)
-            type_name = "array" if isinstance(value, list) else "object"
+            type_name = "array" if isinstance(value, ARRAY_TYPES) else "object"
             return f"{type_name} ({count} items)"
         else:
             return str(value)
 
-    def print_text_tree(self, expand_all: bool = False):
+    def print_text_tree(self, expand_all: bool = False, out: TextIO = None):
         """Print a text-based tree representation."""
+        out = out or sys.stdout
         if not self.data:
-            print("No data loaded")
+            out.write("No data loaded\n")
             return
 
-        print(f"\nTree structure of: {self.file_path}")
-        print("=" * 50)
-        self._print_node(self.data, "", True, expand_all)
+        out.write(f"\nTree structure of: {self.file_path}\n")
+        out.write("=" * 50 + "\n")
+        self._write_tree(self.data, out, expand_all)
 
-    def _print_node(self, node: Any, prefix: str, is_last: bool, expand_all: bool, depth: int = 0):
-        """Recursively print tree nodes."""
-        # Limit depth to prevent extremely deep trees
-        if depth > 20:
-            print(f"{prefix}{'└── ' if is_last else '├── '}... (max depth reached)")
-            return
+    @staticmethod
+    def _children(node: Any):
+        """Yield (label, value, is_last) for the children of a container."""
+        last = len(node) - 1
+        if isinstance(node, OBJECT_TYPES):
+            for i, (key, value) in enumerate(node.items()):
+                yield key, value, i == last
+        elif isinstance(node, ARRAY_TYPES):
+            for i, item in enumerate(node):
+                yield f"[{i}]", item, i == last
 
-        if isinstance(node, dict):
-            items = list(node.items())
-            for i, (key, value) in enumerate(items):
-                is_last_item = i == len(items) - 1
-                current_prefix = "└── " if is_last_item else "├── "
-
-                if isinstance(value, (dict, list)) and value:
-                    print(f"{prefix}{current_prefix}{key}: {self._format_value(value)}")
-                    next_prefix = prefix + ("    " if is_last_item else "│   ")
-                    # Auto-expand first 2 levels
-                    if expand_all or depth < 2:
-                        self._print_node(value, next_prefix, True, expand_all, depth + 1)
-                else:
-                    print(f"{prefix}{current_prefix}{key}: {self._format_value(value)}")
+    def _write_tree(self, root: Any, out: TextIO, expand_all: bool):
+        """Write the tree below root, iteratively so any depth works, in batches of OUTPUT_BATCH lines."""
+        # Hot loop, look up methods once
+        format_value = self._format_value
+        children_of = self._children
+        lines = []
+        append = lines.append
+        # One entry per open level: (children iterator, line prefix, depth)
+        stack = [(children_of(root), "", 0)]
+        while stack:
+            children, prefix, depth = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                continue
 
-        elif isinstance(node, list):
-            for i, item in enumerate(node):
-                is_last_item = i == len(node) - 1
-                current_prefix = "└── " if is_last_item else "├── "
-
-                if isinstance(item, (dict, list)) and item:
-                    print(f"{prefix}{current_prefix}[{i}]: {self._format_value(item)}")
-                    next_prefix = prefix + ("    " if is_last_item else "│   ")
-                    if expand_all or depth < 2:
-                        self._print_node(item, next_prefix, True, expand_all, depth + 1)
-                else:
-                    print(f"{prefix}{current_prefix}[{i}]: {self._format_value(item)}")
+            label, value, is_last = child
+            append(f"{prefix}{'└── ' if is_last else '├── '}{label}: {format_value(value)}\n")
+            if len(lines) >= OUTPUT_BATCH:
+                out.write("".join(lines))
+                lines.clear()
+
+            # Auto-expand first 2 levels
+            if (expand_all or depth < 2) and (
+                    (isinstance(value, CONTAINER_TYPES) and value) or isinstance(value, LAZY_NODES)):
+                # Lazy nodes are parsed for printing only, not kept in the tree
+                stack.append((children_of(self.resolve(value)),
+                              prefix + ("    " if is_last else "│   "), depth + 1))
+
+        out.write("".join(lines))
+
+
+class VirtualListView:
+    """List of the children of one container that only has widget rows for what is visible.
+
+    The rows are a fixed pool of Treeview items, as many as fit the window,
+    that are refilled when scrolling: the scroll position is mapped to the index
+    of the first visible child. Memory and update time depend on the window
+    height only, not on the number of children.
+    """
+
+    def __init__(self, parent: tk.Misc, visualizer: TreeVisualizer, on_open=None):
+        self.visualizer = visualizer
+        # Called with the index of a child on double-click or Return
+        self.on_open = on_open
+        self.data: Any = None
+        self._keys: Union[List[Any], None] = None
+        self.offset = 0
+        self.selected: Union[int, None] = None
+        self._rows: List[str] = []
+        self._row_count = 1
+
+        self.frame = ttk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, columns=("value", "type"), selectmode="browse")
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.frame.grid_rowconfigure(0, weight=1)
+        self.frame.grid_columnconfigure(0, weight=1)
+
+        self.tree.column("#0", width=300, minwidth=200)
+        self.tree.column("value", width=300, minwidth=200)
+        self.tree.column("type", width=100, minwidth=80)
+        self.tree.heading("#0", text="Key/Index", anchor=tk.W)
+        self.tree.heading("value", text="Value", anchor=tk.W)
+        self.tree.heading("type", text="Type", anchor=tk.W)
+
+        self.tree.bind("<Configure>", lambda event: self._refresh())
+        self.tree.bind("<MouseWheel>", lambda event: self.scroll_to(self.offset + (-3 if event.delta > 0 else 3)))
+        self.tree.bind("<Button-4>", lambda event: self.scroll_to(self.offset - 3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_to(self.offset + 3))
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+        self.tree.bind("<Double-1>", self._on_open)
+        self.tree.bind("<Return>", self._on_open)
+        for key, step in (("<Up>", -1), ("<Down>", 1), ("<Prior>", "-page"), ("<Next>", "page"),
+                          ("<Home>", "-all"), ("<End>", "all")):
+            self.tree.bind(key, lambda event, step=step: self._move_selection(step))
+
+    def __len__(self) -> int:
+        return len(self.data) if self.data is not None else 0
+
+    def show(self, data: Any, offset: int = 0):
+        """Show the children of a container, starting at index offset."""
+        self.data = self.visualizer.resolve(data)
+        # Positional access to the keys of an object, islice() would walk them on every scroll.
+        # A paged object has it already
+        self._keys = list(self.data) if isinstance(self.data, dict) else None
+        self.selected = None
+        self.offset = offset
+        self._refresh()
+
+    def key_at(self, index: int) -> Any:
+        if isinstance(self.data, PagedObject):
+            return self.data.key_at(index)
+        return self._keys[index] if self._keys is not None else index
+
+    def scroll_to(self, offset: int):
+        self.offset = offset
+        self._refresh()
+
+    def _visible_rows(self) -> int:
+        """Number of rows that fit the widget, measured on the first row shown."""
+        if self._rows:
+            bbox = self.tree.bbox(self._rows[0])
+            if bbox:
+                # bbox y is the heading height
+                return max(1, (self.tree.winfo_height() - bbox[1]) // bbox[3])
+        return self._row_count
+
+    def _refresh(self):
+        """Resize the row pool to the window and fill it from offset."""
+        self._row_count = self._visible_rows()
+        total = len(self)
+        self.offset = max(0, min(self.offset, total - self._row_count))
+        count = min(self._row_count, total - self.offset)
+
+        while len(self._rows) < count:
+            self._rows.append(self.tree.insert("", "end"))
+        if len(self._rows) > count:
+            self.tree.delete(*self._rows[count:])
+            del self._rows[count:]
+
+        format_value = self.visualizer._format_value
+        type_name = self.visualizer._type_name
+        is_object = isinstance(self.data, OBJECT_TYPES)
+        for row, index in zip(self._rows, range(self.offset, self.offset + count)):
+            key = self.key_at(index)
+            value = self.data.value_at(index) if isinstance(self.data, PagedObject) else self.data[key]
+            self.tree.item(row, text=str(key) if is_object else f"[{index}]",
+                           values=(format_value(value), type_name(value)))
+
+        if self.selected is not None and self.offset <= self.selected < self.offset + count:
+            row = self._rows[self.selected - self.offset]
+            if self.tree.selection() != (row,):
+                self.tree.selection_set(row)
+            self.tree.focus(row)
+        elif self.tree.selection():
+            self.tree.selection_remove(*self.tree.selection())
+
+        if total:
+            self.scrollbar.set(self.offset / total, (self.offset + count) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _on_scrollbar(self, command: str, *args):
+        if command == "moveto":
+            self.scroll_to(int(float(args[0]) * len(self)))
+        elif command == "scroll":
+            step = int(args[0])
+            self.scroll_to(self.offset + (step * self._row_count if args[1] == "pages" else step))
+
+    def _on_select(self, event):
+        selection = self.tree.selection()
+        if selection and selection[0] in self._rows:
+            self.selected = self.offset + self._rows.index(selection[0])
+
+    def _move_selection(self, step: Union[int, str]) -> str:
+        """Keyboard navigation over all children, scrolling the selection into view."""
+        total = len(self)
+        if not total:
+            return "break"
+        steps = {"page": self._row_count, "-page": -self._row_count, "all": total, "-all": -total}
+        current = self.selected if self.selected is not None else self.offset - 1
+        self.selected = max(0, min(current + steps.get(step, step), total - 1))
+        if self.selected < self.offset:
+            self.offset = self.selected
+        elif self.selected >= self.offset + self._row_count:
+            self.offset = self.selected - self._row_count + 1
+        self._refresh()
+        # Keep the default Treeview key bindings from moving the focus as well
+        return "break"
+
+    def _on_open(self, event):
+        if self.on_open and self.selected is not None:
+            self.on_open(self.selected)
+        return "break"
 
 
 class TreeVisualizerGUI:
@@ -132,6 +1788,26 @@ class TreeVisualizerGUI:
         self.root.geometry("800x600")
 
         self.visualizer = TreeVisualizer()
+        # Nodes not opened yet: node id -> (container, first child index, end index)
+        self._pending: Dict[str, Tuple[Any, int, Union[int, None]]] = {}
+        # Background loading, see start_loading()
+        self._load_thread = None
+        self._load_cancel = None
+        self._load_queue = None
+        self._loading_name = ""
+        # Search index of the shown file, built in the background on first use, see start_indexing()
+        self._index_thread = None
+        self._index_cancel = None
+        self._index_queue = None
+        self._after_indexing = None
+        # (file path, stream) compared with the loaded file once its load is done, see main()
+        self.compare_after_load = None
+        # Load JSON files into a NodeStore, see main()
+        self.compact = False
+        # Range nodes grouping large containers: node id -> (first index, end index)
+        self._range_nodes: Dict[str, Tuple[int, int]] = {}
+        self._search_results: List[Tuple[Any, ...]] = []
+        self._search_position = 0
         self.setup_ui()
 
     def setup_ui(self):
@@ -143,9 +1819,17 @@ class TreeVisualizerGUI:
         file_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="File", menu=file_menu)
         file_menu.add_command(label="Open...", command=self.open_file)
+        file_menu.add_command(label="Compare with...", command=self.compare_file)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.root.quit)
 
+        view_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="View", menu=view_menu)
+        view_menu.add_command(label="Heaviest subtrees...", command=self.show_heaviest)
+        view_menu.add_command(label="Browse selected node...", accelerator="Ctrl+B",
+                              command=self.browse_selected)
+        self.root.bind("<Control-b>", lambda event: self.browse_selected())
+
         # Main frame
         main_frame = ttk.Frame(self.root)
         main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -154,10 +1838,30 @@ class TreeVisualizerGUI:
         info_frame = ttk.Frame(main_frame)
         info_frame.pack(fill=tk.X, pady=(0, 10))
 
-        ttk.Button(info_frame, text="Open File", command=self.open_file).pack(side=tk.LEFT)
+        self.open_button = ttk.Button(info_frame, text="Open File", command=self.open_file)
+        self.open_button.pack(side=tk.LEFT)
         self.file_label = ttk.Label(info_frame, text="No file loaded")
         self.file_label.pack(side=tk.LEFT, padx=(10, 0))
 
+        # Shown while a file is loading
+        self.cancel_button = ttk.Button(info_frame, text="Cancel", command=self.cancel_loading)
+        self.progress_bar = ttk.Progressbar(info_frame, length=200, maximum=100)
+
+        # Search frame
+        search_frame = ttk.Frame(main_frame)
+        search_frame.pack(fill=tk.X, pady=(0, 10))
+
+        ttk.Label(search_frame, text="Search:").pack(side=tk.LEFT)
+        self.search_entry = ttk.Entry(search_frame)
+        self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.search_entry.bind("<Return>", lambda event: self.search())
+        self.find_button = ttk.Button(search_frame, text="Find", command=self.search)
+        self.find_button.pack(side=tk.LEFT)
+        self.next_button = ttk.Button(search_frame, text="Next", command=self.next_search_result)
+        self.next_button.pack(side=tk.LEFT, padx=(5, 0))
+        self.search_label = ttk.Label(search_frame, text="")
+        self.search_label.pack(side=tk.LEFT, padx=(10, 0))
+
         # Tree frame with scrollbar
         tree_frame = ttk.Frame(main_frame)
         tree_frame.pack(fill=tk.BOTH, expand=True)
@@ -187,90 +1891,673 @@ class TreeVisualizerGUI:
         self.tree.heading("value", text="Value", anchor=tk.W)
         self.tree.heading("type", text="Type", anchor=tk.W)
 
-    def open_file(self):
-        """Open and load a file."""
-        file_path = filedialog.askopenfilename(
-            title="Select JSON or YAML file",
+        self.tree.bind("<<TreeviewOpen>>", self._on_node_open)
+        self.tree.bind("<Double-1>", self._on_double_click)
+
+    def _ask_file(self, title: str) -> str:
+        return filedialog.askopenfilename(
+            title=title,
             filetypes=[
                 ("JSON files", "*.json"),
+                ("JSON Lines files", "*.jsonl *.ndjson"),
                 ("YAML files", "*.yml *.yaml"),
                 ("All files", "*.*")
             ]
         )
 
+    def open_file(self):
+        """Open and load a file."""
+        file_path = self._ask_file("Select JSON or YAML file")
+
+        if file_path:
+            self.start_loading(file_path)
+
+    def compare_file(self):
+        """Load another file and show its differences to the loaded one."""
+        if self.visualizer.data is None:
+            messagebox.showinfo("Compare", "Open the file to compare against first")
+            return
+
+        file_path = self._ask_file("Select file to compare with")
         if file_path:
-            if self.visualizer.load_file(file_path):
-                self.file_label.config(text=f"Loaded: {Path(file_path).name}")
-                self.populate_tree()
+            self.start_loading(file_path, compare=True)
+
+    def start_loading(self, file_path: str, stream: bool = False, compare: bool = False):
+        """Load a file in a background thread, the result is picked up by _poll_loading.
+
+        With compare the loaded file is diffed against the shown one instead of replacing it.
+        """
+        if self._load_thread and self._load_thread.is_alive():
+            return
+
+        base = self.visualizer if compare else None
+        self._load_cancel = threading.Event()
+        self._load_queue = queue.Queue()
+        self._load_thread = threading.Thread(target=self._load_worker,
+                                             args=(file_path, stream, self._load_cancel, self._load_queue, base,
+                                                   self.compact),
+                                             daemon=True)
+
+        self._loading_name = Path(file_path).name
+        self.open_button.state(["disabled"])
+        self.file_label.config(text=f"Loading: {self._loading_name}")
+        self.progress_bar.config(mode="determinate", value=0)
+        self.progress_bar.pack(side=tk.RIGHT)
+        self.cancel_button.pack(side=tk.RIGHT, padx=(0, 10))
+
+        self._load_thread.start()
+        self.root.after(LOAD_POLL_MS, self._poll_loading)
+
+    def cancel_loading(self):
+        if self._load_cancel:
+            self._load_cancel.set()
+            self.file_label.config(text="Cancelling...")
+
+    @staticmethod
+    def _load_worker(file_path: str, stream: bool, cancel: threading.Event, results: queue.Queue,
+                     base: Union[TreeVisualizer, None] = None, compact: bool = False):
+        """Runs in the loader thread, must not touch any tk widget."""
+        # A separate visualizer, the one shown keeps working until the new one is done
+        visualizer = TreeVisualizer()
+
+        def progress(done, total):
+            results.put(("progress", done, total))
+
+        try:
+            if visualizer.load_file(file_path, stream, progress, cancel, compact):
+                if base is not None:
+                    results.put(("status", "Comparing"))
+                    results.put(("diff", visualizer, TreeDiff(base.data, visualizer.data)))
+                    return
+                # Shown right away, the index is built afterwards by start_indexing()
+                results.put(("done", visualizer))
             else:
-                messagebox.showerror("Error", "Failed to load file")
+                results.put(("cancelled" if cancel.is_set() else "failed", visualizer))
+        except Exception as e:
+            # Anything escaping would end the thread silently, with the GUI waiting for it forever
+            visualizer.close()
+            results.put(("error", visualizer, None, str(e)))
+
+    def _poll_loading(self):
+        """Handle messages from the loader thread, reschedules itself until the load is finished."""
+        try:
+            while True:
+                message = self._load_queue.get_nowait()
+                if message[0] == "progress":
+                    self._show_progress(message[1], message[2])
+                elif message[0] == "status":
+                    self._show_progress(None, 0)
+                    self.file_label.config(text=f"{message[1]}: {self._loading_name}")
+                else:
+                    self._finish_loading(*message)
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(LOAD_POLL_MS, self._poll_loading)
+
+    def _show_progress(self, done: Union[int, None], total: int):
+        if done is None:
+            # The parser doesn't report progress, just show that something is going on
+            if str(self.progress_bar.cget("mode")) != "indeterminate":
+                self.progress_bar.config(mode="indeterminate")
+                self.progress_bar.start()
+                self.file_label.config(text=f"Parsing: {self._loading_name}")
+        elif total:
+            self.progress_bar.config(value=100 * done / total)
+
+    def _finish_loading(self, status: str, visualizer: TreeVisualizer, diff: Union[TreeDiff, None] = None,
+                        error: str = ""):
+        self.progress_bar.stop()
+        self.progress_bar.pack_forget()
+        self.cancel_button.pack_forget()
+        self.open_button.state(["!disabled"])
+        self._load_thread = None
+        self._load_cancel = None
+
+        if status == "done":
+            self._stop_indexing()
+            self.visualizer.close()
+            self.visualizer = visualizer
+            self.file_label.config(text=f"Loaded: {visualizer.file_path.name}")
+            self.populate_tree()
+            # The index can take more memory than a streamed or compact load, it's only built when needed
+            self._set_search_enabled(True)
+            if self.compare_after_load:
+                file_path, stream = self.compare_after_load
+                self.compare_after_load = None
+                self.start_loading(file_path, stream, compare=True)
+        elif status == "diff":
+            self.file_label.config(text=f"Loaded: {self.visualizer.file_path.name}")
+            self.show_diff(diff, self.visualizer, visualizer)
+        elif status == "cancelled":
+            self.file_label.config(text="Loading cancelled")
+        else:
+            self.file_label.config(text="No file loaded" if not self.visualizer.data
+                                   else f"Loaded: {self.visualizer.file_path.name}")
+            messagebox.showerror("Error", f"Failed to load file: {error}" if error else "Failed to load file")
+
+    def start_indexing(self, then=None):
+        """Build the search index of the shown file in a background thread, then is called once it's done.
+
+        Search is disabled while the index is built.
+        """
+        self._stop_indexing()
+        self._after_indexing = then
+        self._set_search_enabled(False)
+        self.search_label.config(text="Indexing...")
+        self._index_cancel = threading.Event()
+        self._index_queue = queue.Queue()
+        self._index_thread = threading.Thread(target=self._index_worker,
+                                              args=(self.visualizer, self._index_cancel, self._index_queue),
+                                              daemon=True)
+        self._index_thread.start()
+        self.root.after(LOAD_POLL_MS, self._poll_indexing, self._index_queue)
+
+    def _stop_indexing(self):
+        """Cancel a running index build, and wait for it so the document it reads can be closed."""
+        if self._index_thread and self._index_thread.is_alive():
+            self._index_cancel.set()
+            self._index_thread.join()
+        self._index_thread = None
+        self._index_cancel = None
+        self._index_queue = None
+        self._after_indexing = None
+
+    @staticmethod
+    def _index_worker(visualizer: TreeVisualizer, cancel: threading.Event, results: queue.Queue):
+        """Runs in the index thread, must not touch any tk widget."""
+        try:
+            visualizer.build_index(cancel)
+        except LoadCancelled:
+            results.put(("cancelled",))
+        except Exception as e:
+            results.put(("error", str(e)))
+        else:
+            results.put(("done",))
+
+    def _poll_indexing(self, results: queue.Queue):
+        """Enable search once the index thread is done, reschedules itself until then."""
+        if results is not self._index_queue:
+            # Stopped, another file is shown
+            return
+        try:
+            message = results.get_nowait()
+        except queue.Empty:
+            self.root.after(LOAD_POLL_MS, self._poll_indexing, results)
+            return
+
+        then = self._after_indexing
+        self._index_thread = None
+        self._index_cancel = None
+        self._index_queue = None
+        self._after_indexing = None
+        self._set_search_enabled(True)
+        self.search_label.config(text="")
+        if message[0] == "done":
+            if then:
+                then()
+        elif message[0] == "error":
+            self.search_label.config(text="Indexing failed")
+            messagebox.showerror("Error", f"Failed to index file: {message[1]}")
+
+    def _set_search_enabled(self, enabled: bool):
+        for widget in (self.search_entry, self.find_button, self.next_button):
+            widget.state(["!disabled"] if enabled else ["disabled"])
 
     def populate_tree(self):
         """Populate the treeview with data."""
         # Clear existing items
         for item in self.tree.get_children():
             self.tree.delete(item)
+        self._pending.clear()
+        self._range_nodes.clear()
+        self._search_results = []
+        self.search_label.config(text="")
 
         if not self.visualizer.data:
             return
 
         # Add root node
-        root_type = "object" if isinstance(self.visualizer.data, dict) else "array"
+        root_type = "object" if isinstance(self.visualizer.data, OBJECT_TYPES) else "array"
         root_id = self.tree.insert("", "end", text="root", values=("", root_type))
 
-        # Populate tree recursively
-        self._populate_node(root_id, self.visualizer.data)
+        # Only the first level is inserted, deeper levels are inserted when opened
+        if self.visualizer._is_expandable(self.visualizer.data):
+            self._populate_node(root_id, self.visualizer.data)
 
         # Expand root node
         self.tree.item(root_id, open=True)
 
-    def _populate_node(self, parent_id: str, data: Any):
-        """Recursively populate tree nodes."""
-        if isinstance(data, dict):
-            for key, value in data.items():
-                value_str = self.visualizer._format_value(value)
-                value_type = type(value).__name__
+    def _defer_node(self, node_id: str, data: Any, start: int = 0, end: Union[int, None] = None):
+        """Give a node a placeholder child, its real children are inserted when it's opened."""
+        self._pending[node_id] = (data, start, end)
+        self.tree.insert(node_id, "end", text=PLACEHOLDER_TEXT)
 
-                node_id = self.tree.insert(parent_id, "end", text=str(key), 
-                                         values=(value_str, value_type))
+    def _on_node_open(self, event):
+        """Insert the children of a node on its first expansion."""
+        self._expand_pending(self.tree.focus())
 
-                if isinstance(value, (dict, list)) and value:
-                    self._populate_node(node_id, value)
+    def _expand_pending(self, node_id: str):
+        pending = self._pending.pop(node_id, None)
+        if pending is None:
+            return
 
-        elif isinstance(data, list):
-            for i, item in enumerate(data):
-                value_str = self.visualizer._format_value(item)
-                value_type = type(item).__name__
+        data, start, end = pending
+        self.tree.delete(*self.tree.get_children(node_id))
+        self._populate_node(node_id, self.visualizer.resolve(data), start, end)
+
+    def _populate_node(self, parent_id: str, data: Any, start: int = 0, end: Union[int, None] = None):
+        """Insert the children data[start:end] of a node, one level only."""
+        end = len(data) if end is None else end
+
+        # Too many children for one level, group them in ranges of PAGE_SIZE (or PAGE_SIZE^n) items
+        if end - start > PAGE_SIZE:
+            chunk_size = PAGE_SIZE
+            while (end - start) > chunk_size * PAGE_SIZE:
+                chunk_size *= PAGE_SIZE
+            for chunk_start in range(start, end, chunk_size):
+                chunk_end = min(chunk_start + chunk_size, end)
+                chunk_id = self.tree.insert(parent_id, "end", text=f"[{chunk_start}..{chunk_end - 1}]",
+                                            values=(f"{chunk_end - chunk_start} items", "range"))
+                self._range_nodes[chunk_id] = (chunk_start, chunk_end)
+                self._defer_node(chunk_id, data, chunk_start, chunk_end)
+            return
+
+        if isinstance(data, PagedObject):
+            children = ((str(data.key_at(i)), data.value_at(i)) for i in range(start, end))
+        elif isinstance(data, dict):
+            children = ((str(key), value) for key, value in itertools.islice(data.items(), start, end))
+        else:
+            children = ((f"[{i}]", data[i]) for i in range(start, end))
+
+        for text, value in children:
+            value_str = self.visualizer._format_value(value)
+            value_type = self.visualizer._type_name(value)
+
+            node_id = self.tree.insert(parent_id, "end", text=text,
+                                       values=(value_str, value_type))
+
+            if self.visualizer._is_expandable(value):
+                self._defer_node(node_id, value)
+
+    def search(self):
+        """Search the loaded data and jump to the first match."""
+        query = self.search_entry.get().strip()
+        if not query or self.visualizer.data is None or self._index_thread:
+            return
+        if self.visualizer.index is None and not query.startswith("$"):
+            self.start_indexing(then=self.search)
+            return
+        try:
+            self._search_results = self.visualizer.search(query)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+
+        self._search_position = 0
+        if not self._search_results:
+            self.search_label.config(text="No matches")
+            return
+        self._show_search_result()
+
+    def next_search_result(self):
+        if self._search_results:
+            self._search_position = (self._search_position + 1) % len(self._search_results)
+            self._show_search_result()
+
+    def _show_search_result(self):
+        count = len(self._search_results)
+        more = "+" if count >= SEARCH_LIMIT else ""
+        self.search_label.config(text=f"{self._search_position + 1}/{count}{more}")
+        self.reveal_path(self._search_results[self._search_position])
+
+    def reveal_path(self, path: Tuple[Any, ...]):
+        """Open the nodes along path and select the node it leads to."""
+        node_id = self.tree.get_children()[0]
+        data = self.visualizer.data
+        for key in path:
+            data = self.visualizer.resolve(data)
+            position = key if isinstance(data, ARRAY_TYPES) else next(i for i, k in enumerate(data) if k == key)
+            node_id = self._child_at(node_id, position)
+            data = data[key]
+
+        self.tree.selection_set(node_id)
+        self.tree.focus(node_id)
+        self.tree.see(node_id)
+
+    def _child_at(self, node_id: str, position: int) -> str:
+        """Node id of the child at position of a container node, going through range nodes."""
+        while True:
+            self._expand_pending(node_id)
+            self.tree.item(node_id, open=True)
+            children = self.tree.get_children(node_id)
+            if children[0] not in self._range_nodes:
+                start = self._range_nodes.get(node_id, (0, 0))[0]
+                return children[position - start]
+            node_id = next(child for child in children
+                           if self._range_nodes[child][0] <= position < self._range_nodes[child][1])
+
+    def _node_path(self, node_id: str) -> Tuple[Any, ...]:
+        """Path of the data shown by a tree node, the inverse of _child_at()."""
+        positions = []
+        while self.tree.parent(node_id):
+            parent_id = self.tree.parent(node_id)
+            if node_id not in self._range_nodes:
+                positions.append(self._range_nodes.get(parent_id, (0, 0))[0] + self.tree.index(node_id))
+            node_id = parent_id
+
+        path = []
+        data = self.visualizer.data
+        for position in reversed(positions):
+            data = self.visualizer.resolve(data)
+            key = position if isinstance(data, ARRAY_TYPES) else next(itertools.islice(data, position, None))
+            path.append(key)
+            data = data[key]
+        return tuple(path)
+
+    def _position(self, path: Tuple[Any, ...], key: Any) -> int:
+        """Index of key among the children of the container at path."""
+        data = self.visualizer.resolve(get_path(self.visualizer.data, path))
+        return key if isinstance(data, ARRAY_TYPES) else next(i for i, k in enumerate(data) if k == key)
+
+    def _on_double_click(self, event):
+        """Range nodes are browsed in a list view instead of being opened."""
+        node_id = self.tree.identify_row(event.y)
+        if node_id in self._range_nodes:
+            self.browse_node(node_id)
+            return "break"
+
+    def browse_selected(self):
+        node_id = self.tree.focus()
+        if node_id and self.visualizer.data is not None:
+            self.browse_node(node_id)
+
+    def browse_node(self, node_id: str):
+        """Show the children of a node in a virtual list view, for nodes too wide for the tree.
 
-                node_id = self.tree.insert(parent_id, "end", text=f"[{i}]", 
-                                         values=(value_str, value_type))
+        Containers within it are browsed by double-clicking them, and "Show in tree" reveals
+        the selected child in the main tree.
+        """
+        path = self._node_path(node_id)
+        offset = self._range_nodes.get(node_id, (0, 0))[0]
+        if not self.visualizer._is_expandable(get_path(self.visualizer.data, path)):
+            if not path:
+                return
+            # A leaf, browse its parent from there
+            path, offset = path[:-1], self._position(path[:-1], path[-1])
 
-                if isinstance(item, (dict, list)) and item:
-                    self._populate_node(node_id, item)
+        window = tk.Toplevel(self.root)
+        window.title(f"Browse: {self.visualizer.file_path.name}")
+        window.geometry("800x600")
+
+        toolbar = ttk.Frame(window)
+        toolbar.pack(fill=tk.X, padx=10, pady=5)
+        path_label = ttk.Label(toolbar)
+        view = VirtualListView(window, self.visualizer)
+        view.frame.pack(fill=tk.BOTH, expand=True)
+        current = [path]
+
+        def show(new_path: Tuple[Any, ...], start: int = 0):
+            data = self.visualizer.resolve(get_path(self.visualizer.data, new_path))
+            current[0] = new_path
+            path_label.config(text=f"{format_path(new_path)} ({len(data)} items)")
+            view.show(data, start)
+
+        def open_child(index: int):
+            key = view.key_at(index)
+            if self.visualizer._is_expandable(view.data[key]):
+                show(current[0] + (key,))
+
+        def go_up():
+            if current[0]:
+                show(current[0][:-1], self._position(current[0][:-1], current[0][-1]))
+
+        def show_in_tree():
+            if view.selected is not None:
+                self.reveal_path(current[0] + (view.key_at(view.selected),))
+
+        view.on_open = open_child
+        ttk.Button(toolbar, text="Up", command=go_up).pack(side=tk.LEFT)
+        ttk.Button(toolbar, text="Show in tree", command=show_in_tree).pack(side=tk.LEFT, padx=(5, 0))
+        path_label.pack(side=tk.LEFT, padx=(10, 0))
+        show(path, offset)
+        view.tree.focus_set()
+
+    def show_diff(self, diff: TreeDiff, old: TreeVisualizer, new: TreeVisualizer):
+        """Show a diff as a colour coded tree in its own window."""
+        window = tk.Toplevel(self.root)
+        window.title(f"Diff: {old.file_path.name} -> {new.file_path.name}")
+        window.geometry("800x600")
+
+        counts = diff.counts
+        ttk.Label(window, text=f"{counts['added']} added, {counts['removed']} removed, "
+                               f"{counts['changed']} changed").pack(anchor=tk.W, padx=10, pady=5)
+
+        tree_frame = ttk.Frame(window)
+        tree_frame.pack(fill=tk.BOTH, expand=True)
+        tree = ttk.Treeview(tree_frame, columns=("old", "new"))
+        v_scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=v_scrollbar.set)
+        tree.grid(row=0, column=0, sticky="nsew")
+        v_scrollbar.grid(row=0, column=1, sticky="ns")
+        tree_frame.grid_rowconfigure(0, weight=1)
+        tree_frame.grid_columnconfigure(0, weight=1)
+
+        tree.column("#0", width=300, minwidth=200)
+        tree.heading("#0", text="Key/Index", anchor=tk.W)
+        tree.heading("old", text=old.file_path.name, anchor=tk.W)
+        tree.heading("new", text=new.file_path.name, anchor=tk.W)
+        for status, color in DIFF_GUI_COLORS.items():
+            tree.tag_configure(status, foreground=color)
+
+        if diff.root.status == "same":
+            tree.insert("", "end", text="No differences", tags=("same",))
+            new.close()
+            return
+
+        format_value = self.visualizer._format_value
+        root_id = tree.insert("", "end", text="root", open=True, tags=(diff.root.status,), values=(
+            format_value(diff.root.old), format_value(diff.root.new)))
+        # Only changes are in the diff tree, it is inserted in one go
+        stack = [(root_id, diff.root)]
+        while stack:
+            parent_id, node = stack.pop()
+            for label, child in node.children:
+                old_text = "" if child.status == "added" else format_value(child.old)
+                new_text = "" if child.status == "removed" else format_value(child.new)
+                child_id = tree.insert(parent_id, "end", text=f"{DIFF_MARKERS[child.status]} {label}",
+                                       values=(old_text, new_text), tags=(child.status,), open=True)
+                if child.status == "modified":
+                    stack.append((child_id, child))
+            if node.unchanged:
+                tree.insert(parent_id, "end", text=f"... {node.unchanged} unchanged", tags=("same",))
+        # Everything shown is formatted, the compared file isn't needed anymore
+        new.close()
+
+    def show_heaviest(self):
+        """List the largest subtrees of the loaded document, double-click jumps to one."""
+        index = self.visualizer.index
+        if index is None:
+            if self.visualizer.data is None:
+                messagebox.showinfo("Heaviest subtrees", "No file loaded")
+            elif not self._index_thread:
+                self.start_indexing(then=self.show_heaviest)
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title(f"Heaviest subtrees: {self.visualizer.file_path.name}")
+        window.geometry("700x400")
+
+        table = ttk.Treeview(window, columns=("size", "share", "nodes", "depth"))
+        scrollbar = ttk.Scrollbar(window, orient=tk.VERTICAL, command=table.yview)
+        table.configure(yscrollcommand=scrollbar.set)
+        table.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        table.column("#0", width=360, minwidth=200)
+        for column in ("size", "share", "nodes", "depth"):
+            table.column(column, width=80, minwidth=60, anchor=tk.E)
+            table.heading(column, text=column.capitalize(), anchor=tk.E)
+        table.heading("#0", text="Path", anchor=tk.W)
+
+        total_size = index.sizes[0] or 1
+        paths = {}
+        for node_id in index.heaviest(HEAVIEST_GUI_LIMIT):
+            item = table.insert("", "end", text=format_path(index.path(node_id)), values=(
+                TreeVisualizer._format_size(index.sizes[node_id]),
+                f"{100 * index.sizes[node_id] / total_size:.1f}%",
+                index.descendants[node_id] + 1,
+                index.heights[node_id]))
+            paths[item] = index.path(node_id)
+
+        def reveal_selected(event):
+            if table.focus() in paths:
+                self.reveal_path(paths[table.focus()])
+
+        table.bind("<Double-1>", reveal_selected)
 
     def run(self):
         """Start the GUI application."""
         self.root.mainloop()
 
 
+def query_file(file_path: str, components: List[Any]):
+    """Yield (path, value) for the values in a file matching parsed path components.
+
+    JSON is scanned with the streaming loader, which parses only the matches,
+    other formats are loaded as a whole first.
+    """
+    path = Path(file_path)
+    if detect_format(path) == "json":
+        with open(path, 'rb') as f:
+            head = f.read(4096).lstrip()
+        if head.startswith((b"{", b"[")):
+            loader = StreamingJSONLoader(path)
+            try:
+                yield from loader.query(components)
+            finally:
+                loader.close()
+            return
+
+    visualizer = TreeVisualizer()
+    # Load messages would end up between the values
+    with redirect_stdout(sys.stderr):
+        loaded = visualizer.load_file(file_path)
+    if not loaded:
+        raise ValueError(f"Failed to load {file_path}")
+    for match_path in find_paths(visualizer.data, components):
+        yield match_path, get_path(visualizer.data, match_path)
+
+
+def query_main(argv: List[str]):
+    """The query subcommand: print the values matching a path, one per line."""
+    parser = argparse.ArgumentParser(prog="yj-tree.py query",
+                                     description="Print the values matching a path, as JSON, one per line")
+    parser.add_argument("path", help="Path like '$.items[*].metadata.name', '*' matches any key/index")
+    parser.add_argument("file", help="Path to YAML or JSON file")
+    parser.add_argument("--paths", action="store_true", help="Print the path of each value before it")
+    parser.add_argument("--raw", action="store_true", help="Print strings without JSON quoting")
+    parser.add_argument("-o", "--output", metavar="FILE", help="Write the values to FILE")
+    args = parser.parse_args(argv)
+
+    if not Path(args.file).exists():
+        print(f"Error: File '{args.file}' not found")
+        sys.exit(1)
+
+    found = False
+    try:
+        components = parse_path(args.path)
+        with text_output(args.output) as out:
+            for path, value in query_file(args.file, components):
+                found = True
+                if args.raw and isinstance(value, str):
+                    text = value
+                else:
+                    text = dump_json(value)
+                out.write(f"{format_path(path)}: {text}\n" if args.paths else f"{text}\n")
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    # Like grep, nothing found is a failure
+    sys.exit(0 if found else 1)
+
+
+def start_pager() -> Union[subprocess.Popen, None]:
+    """Start $PAGER (less by default) reading from a pipe, None with a warning if it can't be run."""
+    command = os.environ.get("PAGER", "less")
+    try:
+        args = shlex.split(command)
+        if not args:
+            raise ValueError("empty command")
+        return subprocess.Popen(args, stdin=subprocess.PIPE, encoding='utf-8', bufsize=OUTPUT_BUFFER_SIZE)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Can't run pager '{command}' ({e}), writing to stdout", file=sys.stderr)
+        return None
+
+
+@contextmanager
+def text_output(output_file: Union[str, None] = None, use_pager: bool = False):
+    """Stream for text mode output: a file, the $PAGER (less by default) or stdout."""
+    pager = start_pager() if use_pager and not output_file else None
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as out:
+            yield out
+        print(f"Output written to: {output_file}")
+    elif pager:
+        try:
+            yield pager.stdin
+            pager.stdin.close()
+        except BrokenPipeError:
+            # Pager quit before everything was written
+            pass
+        pager.wait()
+    else:
+        try:
+            yield sys.stdout
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # Reader went away (e.g. piped to head), silence the flush at exit
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
 def main():
     """Main function to handle command line arguments."""
+    if len(sys.argv) > 1 and sys.argv[1] == "query":
+        query_main(sys.argv[2:])
+
     parser = argparse.ArgumentParser(description="Visualize YAML/JSON files as trees")
     parser.add_argument("file", nargs="?", help="Path to YAML or JSON file")
     parser.add_argument("--mode", choices=["gui", "text"], default="gui",
                        help="Visualization mode (default: gui)")
     parser.add_argument("--expand-all", action="store_true",
                        help="Expand all nodes in text mode")
+    parser.add_argument("--search", metavar="QUERY",
+                       help="Print the paths of matching nodes in text mode. Substring of keys/values, "
+                            "'^prefix' or a path like '$.items[*].name'")
+    parser.add_argument("--diff", metavar="OTHER_FILE",
+                       help="Show a structural diff from file to OTHER_FILE")
+    parser.add_argument("--stats", action="store_true",
+                       help="Print node count, depth, size and the heaviest subtrees in text mode")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                       help="Write text mode output to FILE")
+    parser.add_argument("--pager", action="store_true",
+                       help="Show text mode output in $PAGER (default: less)")
+    parser.add_argument("--stream", action="store_true",
+                       help="Always load JSON with the streaming loader, deep subtrees are "
+                            f"parsed on demand (default for files >= {STREAMING_THRESHOLD // (1024 * 1024)} MB)")
+    parser.add_argument("--compact", action="store_true",
+                       help="Load JSON into a compact node store, for files too big for memory otherwise")
 
     args = parser.parse_args()
 
     if args.mode == "gui":
         # GUI mode
         app = TreeVisualizerGUI()
+        app.compact = args.compact
         if args.file:
-            if app.visualizer.load_file(args.file):
-                app.file_label.config(text=f"Loaded: {Path(args.file).name}")
-                app.populate_tree()
+            if args.diff:
+                app.compare_after_load = (args.diff, args.stream)
+            app.start_loading(args.file, args.stream)
         app.run()
 
     else:
@@ -280,11 +2567,34 @@ def main():
             sys.exit(1)
 
         visualizer = TreeVisualizer()
-        if visualizer.load_file(args.file):
-            visualizer.print_text_tree(args.expand_all)
-        else:
+        if not visualizer.load_file(args.file, args.stream, compact=args.compact):
             sys.exit(1)
 
+        other = None
+        if args.diff:
+            other = TreeVisualizer()
+            if not other.load_file(args.diff, args.stream, compact=args.compact):
+                sys.exit(1)
+
+        with text_output(args.output, args.pager) as out:
+            if args.search:
+                try:
+                    visualizer.print_search(args.search, out)
+                except ValueError as e:
+                    print(f"Error: {e}")
+                    sys.exit(1)
+            elif other:
+                try:
+                    visualizer.print_diff(other, out)
+                except ValueError as e:
+                    # Invalid JSON in a streamed subtree, found when it's opened
+                    print(f"Error: {e}")
+                    sys.exit(1)
+            elif args.stats:
+                visualizer.print_stats(out)
+            else:
+                visualizer.print_text_tree(args.expand_all, out)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file